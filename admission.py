@@ -0,0 +1,90 @@
+import collections
+import itertools
+import math
+import threading
+
+# Admission control for display jobs. A panel shows one frame at a time, so every job that is accepted while it is
+# busy waits in an open request. At most max_jobs jobs are in flight (rendering, waiting for or using the panel)
+# and at most per_client of them belong to one client, so a burst of one client cannot take all places. A rejected
+# job gets an estimate of when a place frees up, derived from the measured time jobs spend on the panel.
+
+
+class Admission:
+
+    def __init__(self, max_jobs=8, per_client=3, service_seconds=3.0, samples=1000):
+        """
+        :param max_jobs: jobs in flight, 0 for no limit
+        :param per_client: jobs in flight per client, 0 for no limit
+        :param service_seconds: panel time per job assumed until the first one has been measured
+        :param samples: number of recent waits kept for the percentiles
+        """
+        self.max_jobs = max_jobs
+        self.per_client = per_client
+        self.service_seconds = service_seconds
+        self._lock = threading.Lock()
+        self._tickets = itertools.count(1)
+        # client of every job in flight, in the order they were admitted
+        self._in_flight = collections.OrderedDict()
+        self._clients = collections.Counter()
+        self._waits = collections.deque(maxlen=samples)
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_client = 0
+        self.peak = 0
+
+    def admit(self, client=None):
+        """
+        :returns: a ticket to pass to release() and 0 as the retry time, or None and the seconds after which a
+                  retry can succeed
+        """
+        with self._lock:
+            if self.per_client and self._clients[client] >= self.per_client:
+                self.rejected_client += 1
+                # the client gets a place when its oldest job is done, after all jobs admitted before it
+                position = next(n for n, owner in enumerate(self._in_flight.values(), 1) if owner == client)
+                return None, self._retry_after(position)
+            if self.max_jobs and len(self._in_flight) >= self.max_jobs:
+                self.rejected_full += 1
+                return None, self._retry_after(1)
+
+            ticket = next(self._tickets)
+            self._in_flight[ticket] = client
+            self._clients[client] += 1
+            self.admitted += 1
+            self.peak = max(self.peak, len(self._in_flight))
+            return ticket, 0
+
+    def _retry_after(self, jobs):
+        return max(1, math.ceil(jobs * self.service_seconds))
+
+    def release(self, ticket, wait_seconds=None, service_seconds=None):
+        """
+        :param wait_seconds: time the job waited for the panel
+        :param service_seconds: time the job used the panel, None if it did not
+        """
+        with self._lock:
+            client = self._in_flight.pop(ticket, None)
+            self._clients[client] -= 1
+            if self._clients[client] <= 0:
+                del self._clients[client]
+            if wait_seconds is not None:
+                self._waits.append(wait_seconds)
+            if service_seconds:
+                # moving average, a single slow full refresh does not double the estimate
+                self.service_seconds += 0.2 * (service_seconds - self.service_seconds)
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            return {"max_jobs": self.max_jobs,
+                    "per_client": self.per_client,
+                    "in_flight": len(self._in_flight),
+                    "peak": self.peak,
+                    "clients": len(self._clients),
+                    "admitted": self.admitted,
+                    "rejected_full": self.rejected_full,
+                    "rejected_client": self.rejected_client,
+                    "service_ms": round(self.service_seconds * 1000, 1),
+                    "wait_ms": {f"p{p}": round(waits[min(len(waits) - 1, int(len(waits) * p / 100))] * 1000, 1)
+                                for p in [50, 95, 99]} if waits else {},
+                    "max_wait_ms": round(waits[-1] * 1000, 1) if waits else 0}
@@ -0,0 +1,219 @@
+"""
+compact length-prefixed binary protocol for LAN clients that push many updates.
+
+request frame:  magic (1 byte, 0xE1), command (1 byte), payload length (uint32, big endian), payload
+response frame: magic, status (1 byte), job (uint32), render/clear/upload/refresh time (4 x uint32, microseconds),
+                message length (uint16), message (utf-8)
+
+commands:
+    CMD_PING   empty payload, answered with STATUS_OK
+    CMD_SHOW   payload is a sequence of fields: tag (1 byte), length (uint16), utf-8 value.
+               Tags are FIELD_DATA, FIELD_LABEL (lines separated by \n), FIELD_DISPLAY_TYPE, FIELD_FONT_SIZE,
+               FIELD_SCALE_TYPE, FIELD_FORCE ("1" shows the frame even if it is already on the panel).
+    CMD_FRAME  payload is a prepacked panel buffer (as returned by epd.getbuffer)
+
+A request that the server cannot take on because too many display jobs are in flight is answered with STATUS_BUSY,
+the message says after how many seconds to retry.
+
+A connection stays open after a response, so a client can stream any number of requests over it.
+"""
+import logging
+import socket
+import socketserver
+import struct
+import threading
+
+MAGIC = 0xE1
+
+CMD_PING = 0x00
+CMD_SHOW = 0x01
+CMD_FRAME = 0x02
+
+STATUS_OK = 0x00
+STATUS_ERROR = 0x01
+STATUS_BAD_REQUEST = 0x02
+STATUS_BUSY = 0x03
+
+FIELD_DATA = 0x01
+FIELD_LABEL = 0x02
+FIELD_DISPLAY_TYPE = 0x03
+FIELD_FONT_SIZE = 0x04
+FIELD_SCALE_TYPE = 0x05
+FIELD_FORCE = 0x06
+
+FIELD_NAMES = {
+    FIELD_DATA: "data",
+    FIELD_LABEL: "label",
+    FIELD_DISPLAY_TYPE: "display-type",
+    FIELD_FONT_SIZE: "font-size",
+    FIELD_SCALE_TYPE: "scale-type",
+    FIELD_FORCE: "force",
+}
+
+MAX_PAYLOAD = 64 * 1024
+
+REQUEST_HEADER = struct.Struct("!BBI")
+RESPONSE_HEADER = struct.Struct("!BBIIIIIH")
+FIELD_HEADER = struct.Struct("!BH")
+
+TIMING_KEYS = ["render_ms", "clear_ms", "upload_ms", "refresh_ms"]
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            return None
+        received += n
+    return bytes(buf)
+
+
+def encode_fields(fields):
+    parts = []
+    tags = {v: k for k, v in FIELD_NAMES.items()}
+    for name, value in fields.items():
+        raw = str(value).encode("utf-8")
+        parts.append(FIELD_HEADER.pack(tags[name], len(raw)))
+        parts.append(raw)
+    return b"".join(parts)
+
+
+def decode_fields(payload):
+    fields = {}
+    offset = 0
+    while offset < len(payload):
+        if offset + FIELD_HEADER.size > len(payload):
+            raise ProtocolError("truncated field header")
+        tag, length = FIELD_HEADER.unpack_from(payload, offset)
+        offset += FIELD_HEADER.size
+        if tag not in FIELD_NAMES or offset + length > len(payload):
+            raise ProtocolError(f"invalid field {tag}")
+        fields[FIELD_NAMES[tag]] = payload[offset:offset + length].decode("utf-8")
+        offset += length
+    return fields
+
+
+def encode_request(command, payload=b""):
+    return REQUEST_HEADER.pack(MAGIC, command, len(payload)) + payload
+
+
+def encode_response(status, job=0, timings=None, msg=""):
+    timings = timings or {}
+    # cut on a character boundary, half a multibyte character would break the client's decode
+    raw_msg = msg.encode("utf-8")[:0xFFFF].decode("utf-8", "ignore").encode("utf-8")
+    micros = [int(timings.get(k, 0) * 1000) for k in TIMING_KEYS]
+    return RESPONSE_HEADER.pack(MAGIC, status, job, *micros, len(raw_msg)) + raw_msg
+
+
+def read_response(sock):
+    header = recv_exactly(sock, RESPONSE_HEADER.size)
+    if header is None:
+        raise ProtocolError("connection closed")
+    magic, status, job, *micros, msg_len = RESPONSE_HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError("bad magic")
+    msg = recv_exactly(sock, msg_len) if msg_len else b""
+    return {"status": status,
+            "job": job,
+            "timings": {k: v / 1000 for k, v in zip(TIMING_KEYS, micros)},
+            "msg": msg.decode("utf-8")}
+
+
+class ProtocolHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            header = recv_exactly(self.request, REQUEST_HEADER.size)
+            if header is None:
+                return
+            magic, command, length = REQUEST_HEADER.unpack(header)
+            if magic != MAGIC or length > MAX_PAYLOAD:
+                self.request.sendall(encode_response(STATUS_BAD_REQUEST, msg="bad frame header"))
+                return
+            payload = recv_exactly(self.request, length) if length else b""
+            if payload is None:
+                return
+            self.request.sendall(self.dispatch(command, payload))
+
+    def dispatch(self, command, payload):
+        try:
+            if command == CMD_PING:
+                return encode_response(STATUS_OK)
+            elif command == CMD_SHOW:
+                fields = decode_fields(payload)
+                if "data" not in fields:
+                    raise ProtocolError("data missing")
+                result = self.server.show_job(data=fields["data"],
+                                              labels=fields.get("label", "").split("\n"),
+                                              display_type=fields.get("display-type", None),
+                                              font_size=fields.get("font-size", "auto"),
+                                              scale_type=fields.get("scale-type", "auto"),
+                                              force=fields.get("force", "").lower() in ["1", "true"],
+                                              client=self.client_address[0])
+            elif command == CMD_FRAME:
+                result = self.server.show_job(buffer=payload, client=self.client_address[0])
+            else:
+                raise ProtocolError(f"unknown command {command}")
+        except (ProtocolError, UnicodeDecodeError) as e:
+            return encode_response(STATUS_BAD_REQUEST, msg=repr(e))
+
+        if result.get("rejected"):
+            return encode_response(STATUS_BUSY, result["job"], msg=result["msg"])
+        return encode_response(STATUS_OK if result["result"] else STATUS_ERROR,
+                               result["job"], result["timings"], result["msg"])
+
+
+class ProtocolServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, show_job):
+        self.show_job = show_job
+        super().__init__(address, ProtocolHandler)
+
+
+def start_server(port, show_job, host="0.0.0.0"):
+    """
+    starts the listener in a background thread.
+    :param show_job: the render/display core, called with the same keyword arguments as einkdisplay.show_job
+    """
+    server = ProtocolServer((host, port), show_job)
+    thread = threading.Thread(target=server.serve_forever, name="binary-protocol", daemon=True)
+    thread.start()
+    logging.info(f"binary protocol listening on port {port}")
+    return server
+
+
+class Client:
+    """
+    minimal client that keeps one connection open for any number of updates.
+    """
+
+    def __init__(self, host, port, timeout=60):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def ping(self):
+        self.sock.sendall(encode_request(CMD_PING))
+        return read_response(self.sock)
+
+    def show(self, data, label="", **options):
+        fields = {"data": data, "label": label}
+        fields.update({k.replace("_", "-"): v for k, v in options.items()})
+        self.sock.sendall(encode_request(CMD_SHOW, encode_fields(fields)))
+        return read_response(self.sock)
+
+    def show_frame(self, buffer):
+        self.sock.sendall(encode_request(CMD_FRAME, bytes(buffer)))
+        return read_response(self.sock)
+
+    def close(self):
+        self.sock.close()
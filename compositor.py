@@ -0,0 +1,138 @@
+import functools
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Composition of frames directly in the packed panel RAM layout: rows of width / 8 bytes, most significant bit
+# first, 1 = white. Every part of a layout (the QR module grid, label lines, the scale bar) is a packed bitmap that
+# is turned into the panel's orientation before it is packed, so composing a frame is a series of shifted
+# AND/OR operations on byte rows and no PIL image is involved.
+#
+# Positions are given in the coordinates of the layout's canvas (see rendering.compute_layout) and mapped to the
+# panel with a rotation: None if the canvas has the panel's orientation, "cw" if the panel shows the canvas
+# turned clockwise by 90 degrees.
+
+available = numpy is not None
+
+# bits: packed rows with a 1 for every black pixel, cover: packed rows with a 1 for every pixel the bitmap sets
+# (black or white), None if only the black pixels are drawn. width and height in pixels.
+Bitmap = namedtuple("Bitmap", ["bits", "cover", "width", "height"])
+
+
+def new_frame(width, height):
+    return numpy.full((height, width // 8), 0xFF, dtype=numpy.uint8)
+
+
+def to_panel(x, y, width, height, canvas_size, rotation):
+    """
+    :returns: the panel position of a width x height area at x, y of the canvas
+    """
+    if rotation == "cw":
+        return canvas_size[1] - y - height, x
+    return x, y
+
+
+def bitmap(mask, rotation=None, cover=None):
+    """
+    packs a mask in canvas orientation.
+    :param mask: 2d array, not 0 for black pixels
+    :param cover: 2d array, not 0 for every pixel the bitmap sets. None draws only the black pixels.
+    """
+    if rotation == "cw":
+        mask = numpy.rot90(mask, -1)
+        if cover is not None:
+            cover = numpy.rot90(cover, -1)
+    height, width = mask.shape
+    return Bitmap(numpy.packbits(mask != 0, axis=1),
+                  numpy.packbits(cover != 0, axis=1) if cover is not None else None,
+                  width, height)
+
+
+def _shifted(bits, shift):
+    # the rows moved right by shift bits, one byte wider
+    height, byte_width = bits.shape
+    out = numpy.zeros((height, byte_width + 1), dtype=numpy.uint8)
+    out[:, :byte_width] = bits >> shift
+    if shift:
+        out[:, 1:] |= bits << (8 - shift)
+    return out
+
+
+def blit(frame, bm, x, y):
+    """
+    draws the bitmap into the frame with its top left pixel at x, y of the panel. Whatever lies outside of the
+    frame is clipped.
+    """
+    height, byte_width = frame.shape
+    column = x >> 3
+    shift = x & 7
+    top, bottom = max(y, 0), min(y + bm.height, height)
+    left, right = max(column, 0), min(column + bm.bits.shape[1] + 1, byte_width)
+    if top >= bottom or left >= right:
+        return
+
+    rows = slice(top - y, bottom - y)
+    columns = slice(left - column, right - column)
+    ink = _shifted(bm.bits, shift)[rows, columns]
+    target = frame[top:bottom, left:right]
+    if bm.cover is None:
+        target &= ~ink
+    else:
+        cover = _shifted(bm.cover, shift)[rows, columns]
+        target &= ~cover
+        target |= cover & ~ink
+
+
+def place(frame, bm, x, y, canvas_size, rotation=None):
+    """
+    draws a bitmap that has already been turned into the panel's orientation at x, y of the canvas.
+    """
+    # the bitmap is rotated, its size in canvas orientation is the other way round
+    width, height = (bm.height, bm.width) if rotation == "cw" else (bm.width, bm.height)
+    blit(frame, bm, *to_panel(x, y, width, height, canvas_size, rotation))
+
+
+def module_bitmap(matrix, scale, rotation=None):
+    """
+    :param matrix: the QR code's module matrix, rows of 0 (light) and 1 (dark)
+    :returns: the code with scale x scale pixels per module, light modules included (opaque)
+    """
+    modules = numpy.array(matrix, dtype=numpy.uint8)
+    if rotation == "cw":
+        modules = numpy.rot90(modules, -1)
+    pixels = numpy.repeat(numpy.repeat(modules, scale, axis=0), scale, axis=1)
+    return Bitmap(numpy.packbits(pixels, axis=1),
+                  numpy.packbits(numpy.ones(pixels.shape, dtype=numpy.uint8), axis=1),
+                  pixels.shape[1], pixels.shape[0])
+
+
+@functools.lru_cache(maxsize=512)
+def _text_bitmap(font, text, start, rotation):
+    # FreeType rasterizes the whole line, which keeps its kerning and clipping identical to ImageDraw.text
+    mask, offset = font.getmask2(text, mode="1", start=start)
+    width, height = mask.size
+    if not width or not height:
+        return None, offset
+    pixels = numpy.frombuffer(bytes(mask), dtype=numpy.uint8).reshape(height, width)
+    return bitmap(pixels, rotation), offset
+
+
+def draw_text(frame, x, y, text, font, canvas_size, rotation=None):
+    """
+    draws a line of text in black like ImageDraw.text on a mode "1" image.
+    """
+    start = (x - int(x), y - int(y))
+    bm, offset = _text_bitmap(font, text, start, rotation)
+    if bm:
+        place(frame, bm, int(x) + offset[0], int(y) + offset[1], canvas_size, rotation)
+
+
+def text_cache_info():
+    return _text_bitmap.cache_info()
+
+
+def to_bytes(frame):
+    return frame.tobytes()
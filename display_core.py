@@ -0,0 +1,944 @@
+import logging
+import collections
+import datetime
+import io
+import os
+import sys
+import time
+import itertools
+import hashlib
+import importlib
+import threading
+from pprint import pformat
+
+from PIL import Image, ImageDraw
+
+from events import EventBus
+from eventlog import EventLog
+import eventlog
+import binary_protocol
+import rendering
+import profiling
+import idlescreen
+import memstats
+from admission import Admission
+import spicalibration
+from pipeline import RenderPool, HardwareThread
+from framestore import FrameStore, frame_key
+from hotlist import HotList
+
+# The display core: owns the panel, renders and shows the jobs. It runs either inside the flask process
+# (einkdisplay.py) or alone in the display daemon (display_daemon.py) that serves any number of HTTP workers.
+
+RaspPI = False
+libdir = ""
+
+# ERROR_CORRECTION = "H"  # can be "l", "M", "Q", "H" (7%, 15%, 25%, 30%=highest correction level)
+
+# possible settings: 1.54, 1.54b, 2.9 or auto to probe the panel at startup
+connected_display_type = os.environ.get("EINK_PANEL", "1.54")
+
+# the panel assumed if the probe finds a black/white panel, the probe cannot tell 1.54" and 2.9" apart
+probe_fallback = os.environ.get("EINK_PANEL_FALLBACK", "1.54")
+
+# the driver module of every supported panel. The drivers share the interface in waveshare/epdbase.py.
+panel_drivers = {
+    "1.54": "epd1in54",
+    "1.54b": "epd1in54b",
+    "2.9": "epd2in9",
+}
+
+# optional TCP port for the binary protocol (see binary_protocol.py). 0 disables the listener.
+binary_protocol_port = int(os.environ.get("EINK_BINARY_PORT", "0"))
+
+# number of render worker processes. 0 renders in the request thread.
+render_workers = int(os.environ.get("EINK_RENDER_WORKERS", str(os.cpu_count() or 1)))
+
+# persistent store of rendered frames (see framestore.py), {panel} is replaced by the panel. Empty disables it.
+frame_store_file = os.environ.get("EINK_FRAME_STORE", "frames-{panel}.bin")
+frame_store_size = int(os.environ.get("EINK_FRAME_STORE_SIZE", "500"))
+
+# requests seen most often and most recently are saved to EINK_HOT_LIST ({panel} is replaced by the panel, empty
+# disables it) and the frames of the EINK_WARM_UP hottest are rendered into the frame store after startup
+hot_list_file = os.environ.get("EINK_HOT_LIST", "hotlist-{panel}.json")
+warm_up_count = int(os.environ.get("EINK_WARM_UP", "50"))
+
+# display jobs in flight (rendering, waiting for or using the panel) and jobs in flight per client, 0 for no limit.
+# More are rejected with an estimate of when to retry (see admission.py).
+max_jobs = int(os.environ.get("EINK_QUEUE_DEPTH", "8"))
+max_jobs_per_client = int(os.environ.get("EINK_QUEUE_PER_CLIENT", "3"))
+
+# number of /preview images kept in memory
+preview_cache_size = int(os.environ.get("EINK_PREVIEW_CACHE", "64"))
+
+# previews that are rendered at a time, in total and per client. Previews share the render pool with the display
+# jobs, so this bounds how far a UI that previews every key stroke can push display jobs back.
+max_previews = int(os.environ.get("EINK_PREVIEW_QUEUE_DEPTH", "2"))
+max_previews_per_client = int(os.environ.get("EINK_PREVIEW_PER_CLIENT", "1"))
+
+# the idle screen with IP addresses, time, queue depth and the last job (see idlescreen.py) is updated at most every
+# EINK_IDLE_SCREEN seconds, 0 disables it. It is shown after the boot screen and, unless EINK_IDLE_AFTER is 0, that
+# many seconds after the last job.
+idle_screen_interval = int(os.environ.get("EINK_IDLE_SCREEN", "0"))
+idle_screen_after = int(os.environ.get("EINK_IDLE_AFTER", "0"))
+
+# partial refreshes of the idle screen between two full refreshes that remove the ghosting
+idle_full_refresh_every = 60
+
+# the structured event log (see eventlog.py). An empty file name keeps the events in memory only.
+event_log_file = os.environ.get("EINK_EVENT_LOG", "events.log")
+event_log_level = os.environ.get("EINK_EVENT_LOG_LEVEL", "INFO").upper()
+event_log_rate = int(os.environ.get("EINK_EVENT_LOG_RATE", "20"))
+
+if os.name == 'posix':
+    libdir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'waveshare')
+    if os.path.exists(libdir):
+        sys.path.append(libdir)
+    if connected_display_type == "auto":
+        from waveshare import epdbase
+        connected_display_type = "1.54b" if epdbase.probe_busy_idle_level() == 1 else probe_fallback
+        logging.info(f"panel probe: {connected_display_type}")
+    if connected_display_type not in panel_drivers:
+        raise Exception(f"unknown panel {connected_display_type}, use one of {', '.join(panel_drivers)} or auto.")
+    display = importlib.import_module(f"waveshare.{panel_drivers[connected_display_type]}")
+
+    RaspPI = True
+
+if connected_display_type == "auto":
+    connected_display_type = probe_fallback
+
+rendering.configure(connected_display_type)
+font_boot_screen = rendering.font_boot_screen
+
+
+def get_ip_addresses(must_include='192.168', debug_log=False):
+    addresses = []
+    try:
+        try:
+            import netifaces
+        except BaseException as e:
+            logging.info(f"kioskstdlib.get_ip_addresses: netifaces module not installed.")
+            return []
+
+        if debug_log:
+            logging.debug(f"get_ip_addresses: Searching network interfaces ...")
+        for dev in netifaces.interfaces():
+            try:
+                if debug_log:
+                    logging.debug(f"get_ip_addresses: Found device {pformat(dev)}:")
+                address = netifaces.ifaddresses(dev)[netifaces.AF_INET]
+                if debug_log:
+                    if address:
+                        logging.debug(f"                  {pformat(address)}")
+                    else:
+                        logging.debug(f"                  No information available.")
+                for part in address:
+                    if 'addr' in part:
+                        if must_include and (part['addr'].find(must_include) > -1):
+                            addresses.append(part['addr'])
+            except BaseException as e:
+                if debug_log:
+                    if "KeyError(2)" in repr(e):
+                        logging.debug(f"                  Device has no IP addresses")
+                    else:
+                        logging.debug(f"                  Could not get more information: {repr(e)} ")
+    except BaseException as e:
+        logging.error(f"kioskstdlib.get_ip_addresses: {repr(e)}")
+
+    if debug_log:
+        logging.debug(f"get_ip_addresses: {len(addresses)} network addresses found.")
+
+    return addresses
+
+
+event_log = EventLog(file_name=event_log_file, file_level=eventlog.levels.get(event_log_level, eventlog.INFO),
+                     max_rate=event_log_rate)
+
+# level of the pipeline events in the event log, everything else is logged at INFO
+event_levels = {
+    "job_failed": eventlog.ERROR,
+    "job_rejected": eventlog.WARNING,
+    "preview_rejected": eventlog.WARNING,
+    "render_done": eventlog.DEBUG,
+    "upload_done": eventlog.DEBUG,
+}
+
+
+def log_event(event):
+    event_log.log(event_levels.get(event["event"], eventlog.INFO), event["event"], **event["data"])
+
+
+event_bus = EventBus(sink=log_event)
+job_counter = itertools.count(1)
+hardware = None
+render_pool = None
+epd = None
+binary_protocol_server = None
+frame_store = None
+hot_list = None
+
+# the frame currently on the panel and the parameters it was rendered from (None for prepacked frames)
+current_frame = {"buffer": None, "params": None, "hash": None}
+
+counters = {"jobs": 0, "noop_skipped": 0}
+
+admission = Admission(max_jobs, max_jobs_per_client)
+preview_admission = Admission(max_previews, max_previews_per_client, service_seconds=0.5)
+
+# /preview images by frame key and orientation, least recently used first
+preview_cache = collections.OrderedDict()
+_preview_lock = threading.Lock()
+
+# jobs: jobs in progress, the idle screen is never updated while there are any
+idle_state = {"active": False, "fields": None, "jobs": 0, "last_job": None, "updates": 0, "partial_refreshes": 0}
+_idle_lock = threading.Lock()
+
+# named regions of a layout and the /show parameter that renders them
+layout_regions = {
+    "label": "labels",
+    "qr": "data",
+    "scale": "scale_type",
+}
+# a region job re-renders when another job changed the panel during its render, at most this many times
+region_attempts = 3
+
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def panel_step(timings, queued, func, *args):
+    # runs on the hardware thread and records how long the job waited for it
+    timings["wait_ms"] = elapsed_ms(queued)
+    return func(*args)
+
+
+def panel_seconds(timings):
+    return sum(timings.get(key, 0) for key in ["clear_ms", "upload_ms", "refresh_ms"]) / 1000
+
+
+def rejected(job, client, retry_after):
+    event_bus.publish("job_rejected", job=job, client=client, retry_after=retry_after)
+    return {"result": False,
+            "msg": f"too many display jobs, retry after {retry_after} s",
+            "job": job,
+            "timings": {},
+            "rejected": True,
+            "retry_after": retry_after}
+
+
+# the panel stays awake between jobs, so that its RAM (and the driver's shadow copy of it) remains valid
+panel_state = {"awake": False, "lut": None}
+
+
+def wake_panel(lut):
+    epd.init(lut)
+    panel_state["awake"] = True
+    panel_state["lut"] = lut
+    event_bus.publish("panel_wake")
+
+
+def sleep_panel():
+    epd.sleep()
+    panel_state["awake"] = False
+    panel_state["lut"] = None
+    event_bus.publish("panel_sleep")
+
+
+def panel_status():
+    status = {"awake": panel_state["awake"], "lut": None}
+    if panel_state["awake"]:
+        status["lut"] = "partial" if panel_state["lut"] is getattr(epd, "lut_partial_update", None) else "full"
+    status.update(epd.shadow.stats())
+    return status
+
+
+def prepare_panel(lut):
+    if not panel_state["awake"]:
+        wake_panel(lut)
+    elif panel_state["lut"] is not lut:
+        epd.SetLut(lut)
+        panel_state["lut"] = lut
+        event_log.debug("panel_lut", lut=panel_status()["lut"])
+
+
+def show_boot_screen():
+    addresses = get_ip_addresses()
+    event_log.info("boot", width=epd.width, height=epd.height, addresses=addresses)
+    logging.info("init and Clear")
+    wake_panel(epd.lut_full_update)
+    epd.Clear(0xFF)
+    time.sleep(1)
+    logging.info(f"lib is {libdir}")
+    square = epd.capabilities["native_orientation"] == "square"
+    if square:
+        image = Image.new('1', (epd.width, epd.height), 255)  # 255: clear the frame
+    else:
+        image = Image.new('1', (epd.height, epd.width), 255)  # 255: clear the frame
+
+    draw = ImageDraw.Draw(image)
+
+    # draw.rectangle((0, 10, 200, 34), fill=0)
+    line_height = font_boot_screen.size
+    draw.text((8, line_height), f"Kiosk e-Ink Server", font=font_boot_screen, fill=0)
+    draw.text((8, line_height * 2), f"running on IP", font=font_boot_screen, fill=0)
+
+    line = line_height * 3
+    for address in addresses:
+        draw.text((8, line), f"{address}", font=font_boot_screen, fill=0)
+        line += line_height
+
+    line += int(line_height / 2)
+    draw.text((8, line), f"{epd.width} x {epd.height} detected", font=font_boot_screen, fill=0)
+    line += line_height
+    draw.text((8, line), datetime.datetime.now().strftime("%a, %H:%M:%S"), font=font_boot_screen, fill=0)
+    if square:
+        epd.display(epd.getbuffer(image.rotate(270)))
+    else:
+        epd.display(epd.getbuffer(image.rotate(180)))
+
+    time.sleep(2)
+    sleep_panel()
+
+
+_start_lock = threading.Lock()
+
+
+def startup():
+    """
+    initializes the panel, shows the boot screen and starts the render pool and the optional binary protocol
+    listener. Only the one process that owns the panel may call this. Calling it again does nothing.
+    """
+    global hardware, render_pool, epd, binary_protocol_server, frame_store, hot_list
+
+    with _start_lock:
+        if hardware:
+            return
+
+        hardware = HardwareThread()
+        if RaspPI and libdir:
+            profile = spicalibration.load_profile(spicalibration.profile_file(connected_display_type))
+            if profile:
+                from waveshare import epdconfig
+                epdconfig.set_spi(int(profile["spi_hz"]), int(profile["chunk_size"]))
+                event_bus.publish("spi_profile", spi_hz=profile["spi_hz"], chunk_size=profile["chunk_size"],
+                                  bytes_per_s=profile.get("bytes_per_s"))
+            epd = display.EPD()
+            hardware.run(show_boot_screen)
+
+        render_pool = RenderPool(connected_display_type, render_workers)
+
+        if epd and frame_store_file:
+            try:
+                frame_store = FrameStore(frame_store_file.format(panel=connected_display_type), epd.frame_size,
+                                         frame_store_size)
+            except OSError as e:
+                logging.error(f"startup: frame store not available: {repr(e)}")
+
+        if hot_list_file:
+            hot_list = HotList(hot_list_file.format(panel=connected_display_type))
+            if frame_store and warm_up_count:
+                threading.Thread(target=warm_up, args=(warm_up_count,), name="warm-up", daemon=True).start()
+
+        if epd and idle_screen_interval:
+            threading.Thread(target=idle_screen_loop, name="idle-screen", daemon=True).start()
+
+        if RaspPI and binary_protocol_port:
+            binary_protocol_server = binary_protocol.start_server(binary_protocol_port, show_job)
+
+
+def frame_size():
+    return epd.frame_size
+
+
+def display_frame(job, buffer, timings):
+    """
+    clears the panel and shows the frame with full refreshes.
+    :returns: bytes sent and skipped by the differential upload of the frame
+    """
+    start = time.perf_counter()
+    prepare_panel(epd.lut_full_update)
+    epd.Clear(0xFF)
+    timings["clear_ms"] = elapsed_ms(start)
+    event_log.debug("panel_clear", job=job, clear_ms=timings["clear_ms"])
+
+    start = time.perf_counter()
+    epd.upload(buffer)
+    timings["upload_ms"] = elapsed_ms(start)
+    transfer = {"bytes_sent": epd.shadow.last_sent, "bytes_skipped": epd.shadow.last_skipped}
+    event_bus.publish("upload_done", job=job, **timings, **transfer)
+
+    start = time.perf_counter()
+    epd.TurnOnDisplay()
+    timings["refresh_ms"] = elapsed_ms(start)
+    event_bus.publish("refresh_done", job=job, **timings)
+    return transfer
+
+
+def render(params):
+    """
+    :returns: the frame for the parameters from the frame store or freshly rendered
+    """
+    key = frame_key(params, panel_drivers[connected_display_type])
+    if hot_list:
+        hot_list.record(key.hex(), params)
+    buffer = frame_store.get(key) if frame_store else None
+    if buffer is None:
+        buffer = render_pool.render(**params)
+        if frame_store:
+            frame_store.put(key, buffer)
+    return buffer
+
+
+def warm_up(count):
+    """
+    renders the frames of the hottest requests of earlier runs into the frame store. Runs in the background,
+    renders one frame at a time and only while no job waits for the render pool, so it never delays a request.
+    """
+    warmed = 0
+    for params in hot_list.top(count):
+        key = frame_key(params, panel_drivers[connected_display_type])
+        if frame_store.contains(key):
+            continue
+        while render_pool.stats()["queue_depth"] > 0:
+            time.sleep(0.05)
+        try:
+            frame_store.put(key, render_pool.render(**params))
+            warmed += 1
+        except BaseException as e:
+            logging.info(f"warm_up: {params.get('data')} not rendered: {repr(e)}")
+    counters["warmed_up"] = warmed
+    event_log.info("warm_up_done", frames=warmed)
+
+
+def frame_hash(buffer):
+    return hashlib.sha1(bytes(buffer)).hexdigest()
+
+
+def set_current_frame(buffer, params):
+    # one update, so that a request thread never copies the buffer of one frame with the params of another
+    current_frame.update({"buffer": bytes(buffer) if buffer is not None else None,
+                          "params": params,
+                          "hash": frame_hash(buffer) if buffer is not None else None})
+
+
+def is_on_panel(buffer_hash=None, params=None):
+    if buffer_hash:
+        return buffer_hash == current_frame["hash"]
+    return params is not None and params == current_frame["params"]
+
+
+def display_if_changed(job, buffer, params, timings, force):
+    """
+    runs on the hardware thread, so that the check and the update cannot interleave with another job.
+    :returns: the transfer statistics or None if the frame is already on the panel
+    """
+    buffer_hash = frame_hash(buffer)
+    if not force and is_on_panel(buffer_hash):
+        return None
+
+    transfer = display_frame(job, buffer, timings)
+    set_current_frame(buffer, params)
+    return transfer
+
+
+def show_job(data=None, labels=None, display_type=None, font_size="auto", scale_type="auto", buffer=None,
+             force=False, profile=False, tiles=None, client=None):
+    """
+    the render and display core shared by /show and the binary protocol listener.
+    Either renders data and labels, several codes (tiles) on one screen or displays a prepacked panel buffer.
+    A frame that is already on the panel is not shown again unless force is set.
+    :param profile: profile the render and the hardware step and store the result (see profiling.py)
+    :param tiles: list of dicts with data and labels, see rendering.show_tiled
+    :param client: the job counts towards this client's jobs in flight
+    :returns: dict with result, msg, job, timings, transfer, skipped and, if profiled, the profile name.
+              A job rejected by the admission control has rejected set and the seconds after which to retry.
+    """
+    display_type = display_type or connected_display_type
+    job = next(job_counter)
+    ticket, retry_after = admission.admit(client)
+    if ticket is None:
+        return rejected(job, client, retry_after)
+    counters["jobs"] += 1
+    with _idle_lock:
+        # the idle screen steps aside: no update of it starts until the job is done
+        idle_state["jobs"] += 1
+        idle_state["active"] = False
+    event_bus.publish("job_accepted", job=job, display_type=display_type, font_size=font_size,
+                      scale_type=scale_type, prepacked=buffer is not None, tiles=len(tiles) if tiles else 0)
+    rc = True
+    msg = ""
+    timings = {}
+    transfer = {}
+    skipped = False
+    profile_parts = []
+    try:
+        start = time.perf_counter()
+        params = None
+        if buffer is None:
+            params = {"data": data, "labels": labels or [], "display_type": display_type,
+                      "font_size": font_size, "scale_type": scale_type}
+            if tiles:
+                params["tiles"] = tiles
+            if not force and is_on_panel(params=params):
+                skipped = True
+            elif profile:
+                buffer, stats = render_pool.render_profiled(**params)
+                profile_parts.append(stats)
+            else:
+                buffer = render(params)
+        elif len(buffer) != frame_size():
+            raise Exception(f"frame has {len(buffer)} bytes, the connected display needs {frame_size()}.")
+        timings["render_ms"] = elapsed_ms(start)
+
+        if not skipped:
+            event_bus.publish("render_done", job=job, **timings)
+            queued = time.perf_counter()
+            if profile:
+                transfer, stats = hardware.run(panel_step, timings, queued, profiling.run_profiled,
+                                               display_if_changed, job, buffer, params, timings, force)
+                profile_parts.append(stats)
+            else:
+                transfer = hardware.run(panel_step, timings, queued,
+                                        display_if_changed, job, buffer, params, timings, force)
+            skipped = transfer is None
+
+        if skipped:
+            counters["noop_skipped"] += 1
+            transfer = {}
+            event_bus.publish("job_skipped", job=job)
+
+    except BaseException as e:
+        logging.error(f"show_job: Exception {repr(e)}")
+        rc = False
+        msg = repr(e)
+        event_bus.publish("job_failed", job=job, msg=msg)
+
+    with _idle_lock:
+        idle_state["jobs"] -= 1
+        idle_state["last_job"] = {"job": job, "result": rc, "time": time.time()}
+    admission.release(ticket, timings["wait_ms"] / 1000 if "wait_ms" in timings else None, panel_seconds(timings))
+
+    result = {"result": rc,
+              "msg": msg,
+              "job": job,
+              "timings": timings,
+              "transfer": transfer,
+              "skipped": skipped}
+    if profile_parts:
+        result["profile"] = profiling.store(job, profile_parts)
+    return result
+
+
+def frame_png(buffer, display_type, raw=False):
+    """
+    :param raw: keep the orientation of the panel RAM instead of turning the frame the way the layout is drawn
+    :returns: the packed frame as PNG
+    """
+    width, height = rendering.panel_size()
+    with Image.frombytes('1', (width, height), bytes(buffer)) as image:
+        # the panel shows the canvas of a layout turned clockwise, except in portrait orientation
+        if raw or (rendering.orientations() != ["S"] and display_type[-1:] == "P"):
+            upright = image.copy()
+        else:
+            upright = image.transpose(Image.ROTATE_90)
+    out = io.BytesIO()
+    with upright:
+        upright.save(out, format="PNG")
+    return out.getvalue()
+
+
+def preview(data=None, labels=None, display_type=None, font_size="auto", scale_type="auto", tiles=None, raw=False,
+            client=None):
+    """
+    renders like show_job, but returns the frame as PNG instead of showing it. The panel is not touched, the
+    images are cached.
+    :param raw: the image in the orientation of the panel RAM
+    :param client: the render counts towards this client's previews in flight
+    :returns: the frame as PNG, or a dict with result, msg, rejected and retry_after if there are too many previews
+              in flight
+    """
+    display_type = display_type or connected_display_type
+    params = {"data": data, "labels": labels or [], "display_type": display_type,
+              "font_size": font_size, "scale_type": scale_type}
+    if tiles:
+        params["tiles"] = tiles
+    key = frame_key(params, panel_drivers[connected_display_type])
+    with _preview_lock:
+        png = preview_cache.get((key, raw))
+        if png is not None:
+            preview_cache.move_to_end((key, raw))
+            return png
+
+    # previews are not recorded in the hot list and not added to the frame store, a UI sends one for every key stroke
+    ticket, retry_after = preview_admission.admit(client)
+    if ticket is None:
+        event_bus.publish("preview_rejected", client=client, retry_after=retry_after)
+        return {"result": False,
+                "msg": f"too many previews, retry after {retry_after} s",
+                "rejected": True,
+                "retry_after": retry_after}
+    start = time.perf_counter()
+    rendered = False
+    try:
+        # the hits and misses of the frame store are those of display jobs
+        buffer = frame_store.get(key, count=False) if frame_store else None
+        if buffer is None:
+            buffer = render_pool.render(**params)
+            rendered = True
+        png = frame_png(buffer, display_type, raw)
+    finally:
+        preview_admission.release(ticket, None, time.perf_counter() - start if rendered else None)
+    with _preview_lock:
+        preview_cache[(key, raw)] = png
+        while len(preview_cache) > preview_cache_size:
+            preview_cache.popitem(last=False)
+    return png
+
+
+def changed_window(old_buffer, new_buffer):
+    """
+    the smallest window of panel RAM that covers all differences between two frames.
+    :returns: (x_start, y_start, x_end, y_end) in pixels, inclusive and byte aligned, or None if nothing changed
+    """
+    line_width = int(epd.width / 8)
+    rows = [j for j in range(epd.height)
+            if old_buffer[j * line_width:(j + 1) * line_width] != new_buffer[j * line_width:(j + 1) * line_width]]
+    if not rows:
+        return None
+
+    columns = [i for i in range(line_width)
+               if any(old_buffer[j * line_width + i] != new_buffer[j * line_width + i] for j in rows)]
+    return columns[0] * 8, rows[0], columns[-1] * 8, rows[-1]
+
+
+def display_region(job, old_buffer, buffer, timings):
+    """
+    uploads only the changed window of the frame and refreshes it with the partial LUT.
+    Panels without a partial LUT get the whole frame and a full refresh, but no Clear.
+    :returns: the window that has been updated or None if the frame did not change
+    """
+    window = changed_window(old_buffer, buffer)
+    if not window:
+        return None
+
+    start = time.perf_counter()
+    if epd.capabilities["partial_refresh"]:
+        prepare_panel(epd.lut_partial_update)
+        # the upload only sends the rows of the window that differ from the controller RAM
+        epd.upload(buffer)
+        timings["upload_ms"] = elapsed_ms(start)
+        event_bus.publish("upload_done", job=job, window=window, **timings)
+
+        start = time.perf_counter()
+        epd.TurnOnDisplay()
+        # the controller toggles between its two RAM areas on refresh, so the frame has to be written to both
+        epd.upload(buffer)
+        timings["refresh_ms"] = elapsed_ms(start)
+    else:
+        prepare_panel(epd.lut_full_update)
+        epd.upload(buffer)
+        timings["upload_ms"] = elapsed_ms(start)
+        event_bus.publish("upload_done", job=job, **timings)
+
+        start = time.perf_counter()
+        epd.TurnOnDisplay()
+        timings["refresh_ms"] = elapsed_ms(start)
+        window = (0, 0, epd.width - 8, epd.height - 1)
+
+    event_bus.publish("refresh_done", job=job, window=window, **timings)
+
+    return window
+
+
+def display_region_of_frame(job, base_hash, buffer, params, timings):
+    """
+    runs on the hardware thread. Shows a frame that was rendered from the current frame with one region changed,
+    unless another job has changed the panel since then.
+    :returns: whether the frame was applied and the updated window
+    """
+    if current_frame["hash"] != base_hash:
+        return False, None
+    window = display_region(job, current_frame["buffer"], buffer, timings)
+    set_current_frame(buffer, params)
+    return True, window
+
+
+def show_region_job(region, value, client=None):
+    """
+    re-renders the current layout with one region changed and updates only that part of the panel.
+    :param region: one of layout_regions
+    :param value: the new value of the /show parameter that renders the region
+    :param client: see show_job
+    :returns: dict with result, msg, job, timings and the updated window, or the rejection (see show_job)
+    """
+    job = next(job_counter)
+    ticket, retry_after = admission.admit(client)
+    if ticket is None:
+        return rejected(job, client, retry_after)
+    with _idle_lock:
+        idle_state["jobs"] += 1
+        idle_state["active"] = False
+    event_bus.publish("job_accepted", job=job, region=region)
+    rc = True
+    msg = ""
+    timings = {}
+    window = None
+    try:
+        if region not in layout_regions:
+            raise Exception(f"unknown region {region}, use one of {', '.join(layout_regions)}.")
+
+        for attempt in range(region_attempts):
+            frame = dict(current_frame)
+            if not frame["params"]:
+                raise Exception("There is no rendered layout on the display to update.")
+            if "tiles" in frame["params"]:
+                raise Exception("Regions of a tiled screen cannot be updated.")
+
+            start = time.perf_counter()
+            params = dict(frame["params"])
+            params[layout_regions[region]] = value
+            buffer = render_pool.render(**params)
+            timings["render_ms"] = elapsed_ms(start)
+            event_bus.publish("render_done", job=job, **timings)
+
+            applied, window = hardware.run(panel_step, timings, time.perf_counter(),
+                                           display_region_of_frame, job, frame["hash"], buffer, params, timings)
+            if applied:
+                break
+        else:
+            raise Exception("The display kept changing while the region was rendered.")
+
+    except BaseException as e:
+        logging.error(f"show_region_job: Exception {repr(e)}")
+        rc = False
+        msg = repr(e)
+        event_bus.publish("job_failed", job=job, msg=msg)
+
+    with _idle_lock:
+        idle_state["jobs"] -= 1
+        idle_state["last_job"] = {"job": job, "result": rc, "time": time.time()}
+    admission.release(ticket, timings["wait_ms"] / 1000 if "wait_ms" in timings else None, panel_seconds(timings))
+    return {"result": rc,
+            "msg": msg,
+            "job": job,
+            "timings": timings,
+            "window": window}
+
+
+def idle_screen_fields():
+    """
+    :returns: what the idle screen shows. Without partial refresh time and queue are left out, they would cost a
+              full refresh every time they change.
+    """
+    fields = {"addresses": get_ip_addresses(),
+              "time": None,
+              "queue": None,
+              "last_job": idlescreen.describe_job(idle_state["last_job"])}
+    if epd.capabilities["partial_refresh"]:
+        fields["time"] = datetime.datetime.now().strftime("%a, %H:%M")
+        fields["queue"] = render_pool.stats()["queue_depth"] + hardware.stats()["queue_depth"]
+    return fields
+
+
+def update_idle_screen(buffer, fields, full):
+    """
+    runs on the hardware thread. Shows the idle screen with a full refresh or updates the changed window of it with
+    a partial refresh, unless a job has arrived in the meantime.
+    :returns: the updated window or None
+    """
+    with _idle_lock:
+        if idle_state["jobs"] or not (full or idle_state["active"]):
+            return None
+        idle_state["active"] = True
+
+    timings = {}
+    if full or idle_state["partial_refreshes"] >= idle_full_refresh_every:
+        display_frame("idle", buffer, timings)
+        idle_state["partial_refreshes"] = 0
+        window = (0, 0, epd.width - 8, epd.height - 1)
+    else:
+        window = display_region("idle", current_frame["buffer"], buffer, timings)
+        idle_state["partial_refreshes"] += 1
+    set_current_frame(buffer, None)
+    idle_state["fields"] = fields
+    idle_state["updates"] += 1
+    return window
+
+
+def refresh_idle_screen():
+    """
+    shows the idle screen if the panel has been idle long enough or updates it if something on it has changed.
+    Changes between two calls are shown together with one refresh.
+    """
+    with _idle_lock:
+        if idle_state["jobs"]:
+            return
+        full = not idle_state["active"]
+        if full and idle_state["last_job"]:
+            if not idle_screen_after or time.time() - idle_state["last_job"]["time"] < idle_screen_after:
+                return
+
+    fields = idle_screen_fields()
+    if not full and fields == idle_state["fields"]:
+        return
+    buffer = idlescreen.draw(fields, epd.width, epd.height, font_boot_screen)
+    window = hardware.run(update_idle_screen, buffer, fields, full)
+    if window:
+        event_log.debug("idle_screen", window=window, full=full)
+
+
+def idle_screen_loop():
+    while True:
+        # wake up on the full interval, so that the minute on the screen changes right on time
+        time.sleep(idle_screen_interval - time.time() % idle_screen_interval)
+        try:
+            refresh_idle_screen()
+        except BaseException as e:
+            logging.error(f"idle_screen_loop: {repr(e)}")
+
+
+def process_stats():
+    """
+    :returns: memory of the server process and, if psutil is installed, of its render workers in kB
+    """
+    stats = {}
+    try:
+        import resource
+        stats["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        pass
+
+    try:
+        import psutil
+    except ImportError:
+        return stats
+
+    try:
+        process = psutil.Process()
+        stats["rss_kb"] = process.memory_info().rss // 1024
+        stats["workers_rss_kb"] = sum(child.memory_info().rss for child in process.children()) // 1024
+        stats["threads"] = process.num_threads()
+    except psutil.Error as e:
+        logging.debug(f"process_stats: {repr(e)}")
+    return stats
+
+
+def spi_settings():
+    from waveshare import epdconfig
+    return epdconfig.spi_settings()
+
+
+def status():
+    return {
+        "render_pool": render_pool.stats(),
+        "hardware": hardware.stats(),
+        "counters": counters,
+        "panel": panel_status() if epd else {},
+        "capabilities": epd.capabilities if epd else {},
+        "spi": spi_settings() if epd else {},
+        "admission": admission.stats(),
+        "preview_admission": preview_admission.stats(),
+        "frame_store": frame_store.stats() if frame_store else {},
+        "hot_list": hot_list.stats() if hot_list else {},
+        "idle_screen": {"active": idle_state["active"], "updates": idle_state["updates"]},
+        "event_log": event_log.stats(),
+        "process": process_stats(),
+    }
+
+
+def memory_report():
+    """
+    :returns: memory of the process, sizes of the caches of this process in bytes, the number of entries of the
+              caches that cannot be measured in bytes (functools.lru_cache), garbage collector and PIL image counts
+              and the tracemalloc state. The render workers have caches of their own.
+    """
+    caches = {
+        "current_frame": memstats.deep_size(current_frame),
+        "layouts": memstats.deep_size(rendering.layouts),
+        "glyph_widths": memstats.deep_size(rendering.glyph_widths),
+        "previews": memstats.deep_size(preview_cache),
+        "event_log": memstats.deep_size(event_log),
+        "event_bus": memstats.deep_size(event_bus),
+    }
+    entries = {
+        "sized_fonts": rendering.sized_font.cache_info().currsize,
+        "qr_symbols": rendering.qrencoding.cache_info().currsize,
+        "text_bitmaps": rendering.compositor.text_cache_info().currsize if rendering.compositor.available else 0,
+    }
+    if frame_store:
+        caches["frame_store"] = memstats.deep_size(frame_store)
+        caches["frame_store_mapped"] = frame_store.records * frame_store.record_size
+    if hot_list:
+        caches["hot_list"] = memstats.deep_size(hot_list)
+    if epd:
+        caches["ram_shadow"] = memstats.deep_size(epd.shadow)
+
+    return {"process": process_stats(),
+            "caches": caches,
+            "entries": entries,
+            "gc": memstats.gc_stats(),
+            "pil_images": memstats.count_instances(Image.Image),
+            "tracemalloc": memstats.tracing_stats()}
+
+
+def memory_snapshot():
+    return memstats.take_snapshot()
+
+
+def memory_top(name, count=20, key_type="lineno"):
+    """
+    :returns: the top allocation sites of a snapshot or None if there is no such snapshot
+    """
+    if key_type not in memstats.key_types:
+        raise ValueError(f"unknown key type {key_type}, use one of {', '.join(memstats.key_types)}.")
+    return memstats.top_allocations(name, count, key_type)
+
+
+def memory_diff(old_name, new_name, count=20, key_type="lineno"):
+    """
+    :returns: the allocation sites that changed most between two snapshots or None if one does not exist
+    """
+    if key_type not in memstats.key_types:
+        raise ValueError(f"unknown key type {key_type}, use one of {', '.join(memstats.key_types)}.")
+    return memstats.compare_snapshots(old_name, new_name, count, key_type)
+
+
+def memory_stop_tracing():
+    memstats.stop_tracing()
+    return memstats.tracing_stats()
+
+
+def layout_table(version=None, orientation=None):
+    """
+    :returns: the precomputed layouts of the connected display, optionally only those of one QR version
+              and orientation
+    """
+    return [layout for layout in rendering.layout_table()
+            if (version is None or layout["version"] == version)
+            and (orientation is None or layout["orientation"] == orientation)]
+
+
+def list_profiles():
+    return profiling.list_profiles()
+
+
+def read_profile(name, summary=False):
+    return profiling.read_profile(name, summary)
+
+
+def recent_events(count=100, min_level="DEBUG"):
+    """
+    :param min_level: DEBUG, INFO, WARNING or ERROR
+    :returns: the newest count entries of the event log at or above min_level, oldest first
+    """
+    if min_level.upper() not in eventlog.levels:
+        raise ValueError(f"unknown level {min_level}, use one of {', '.join(eventlog.levels)}.")
+    return event_log.recent(count, eventlog.levels[min_level.upper()])
+
+
+def subscribe(last_event_id=None, heartbeat=15):
+    """
+    :returns: a generator of pipeline events. It yields None every heartbeat seconds without events.
+    """
+    return event_bus.listen(event_bus.subscribe(last_event_id), heartbeat)
@@ -0,0 +1,163 @@
+"""
+the display daemon: the one process that owns the panel(s).
+
+HTTP workers (einkdisplay.py with EINK_DAEMON_SOCKET set) talk to it over a local unix socket, so flask can run
+with the reloader, several worker processes or threads without ever touching SPI/GPIO concurrently.
+
+run it with
+
+    python display_daemon.py [socket path]
+
+Messages are (command, kwargs) tuples sent with multiprocessing.connection, answered with ("ok", result) or
+("error", message). The "subscribe" command turns the connection into a stream of pipeline events.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from multiprocessing.connection import Listener, Client
+
+default_socket = "/tmp/einkdisplay.sock"
+
+COMMANDS = ["show_job", "show_region_job", "status", "list_profiles", "read_profile", "recent_events",
+            "layout_table", "preview", "memory_report", "memory_snapshot", "memory_top", "memory_diff",
+            "memory_stop_tracing"]
+
+
+def handle_connection(conn, core):
+    try:
+        while True:
+            command, kwargs = conn.recv()
+            if command == "subscribe":
+                events = core.subscribe(**kwargs)
+                try:
+                    for event in events:
+                        conn.send(event)
+                finally:
+                    events.close()
+                return
+
+            if command not in COMMANDS:
+                conn.send(("error", f"unknown command {command}"))
+                continue
+            try:
+                conn.send(("ok", getattr(core, command)(**kwargs)))
+            except BaseException as e:
+                logging.error(f"display_daemon.handle_connection: {command} failed: {repr(e)}")
+                conn.send(("error", repr(e)))
+    except (EOFError, OSError):
+        pass
+    finally:
+        conn.close()
+
+
+def serve(address=default_socket):
+    import display_core as core
+
+    if os.path.exists(address):
+        os.remove(address)
+
+    core.startup()
+    with Listener(address, family="AF_UNIX") as listener:
+        os.chmod(address, 0o660)
+        logging.info(f"display daemon listening on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError as e:
+                logging.error(f"display_daemon.serve: accept failed: {repr(e)}")
+                time.sleep(1)
+                continue
+            threading.Thread(target=handle_connection, args=(conn, core), daemon=True).start()
+
+
+class DaemonClient:
+    """
+    stands in for display_core in HTTP worker processes. Every thread keeps its own connection to the daemon.
+    """
+
+    def __init__(self, address=default_socket):
+        self.address = address
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, family="AF_UNIX")
+        return conn
+
+    def _call(self, command, **kwargs):
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.send((command, kwargs))
+                status, result = conn.recv()
+                break
+            except (EOFError, OSError):
+                # the daemon has been restarted: reconnect once
+                self._local.conn = None
+                if attempt:
+                    raise
+        if status != "ok":
+            raise Exception(result)
+        return result
+
+    def show_job(self, *args, **kwargs):
+        kwargs.update(zip(["data", "labels", "display_type", "font_size", "scale_type", "buffer", "force",
+                           "profile", "tiles", "client"], args))
+        return self._call("show_job", **kwargs)
+
+    def show_region_job(self, region, value, client=None):
+        return self._call("show_region_job", region=region, value=value, client=client)
+
+    def status(self):
+        return self._call("status")
+
+    def list_profiles(self):
+        return self._call("list_profiles")
+
+    def read_profile(self, name, summary=False):
+        return self._call("read_profile", name=name, summary=summary)
+
+    def layout_table(self, version=None, orientation=None):
+        return self._call("layout_table", version=version, orientation=orientation)
+
+    def recent_events(self, count=100, min_level="DEBUG"):
+        return self._call("recent_events", count=count, min_level=min_level)
+
+    def preview(self, *args, **kwargs):
+        kwargs.update(zip(["data", "labels", "display_type", "font_size", "scale_type", "tiles", "raw",
+                           "client"], args))
+        return self._call("preview", **kwargs)
+
+    def memory_report(self):
+        return self._call("memory_report")
+
+    def memory_snapshot(self):
+        return self._call("memory_snapshot")
+
+    def memory_top(self, name, count=20, key_type="lineno"):
+        return self._call("memory_top", name=name, count=count, key_type=key_type)
+
+    def memory_diff(self, old_name, new_name, count=20, key_type="lineno"):
+        return self._call("memory_diff", old_name=old_name, new_name=new_name, count=count, key_type=key_type)
+
+    def memory_stop_tracing(self):
+        return self._call("memory_stop_tracing")
+
+    def subscribe(self, last_event_id=None, heartbeat=15):
+        conn = Client(self.address, family="AF_UNIX")
+        conn.send(("subscribe", {"last_event_id": last_event_id, "heartbeat": heartbeat}))
+        try:
+            while True:
+                yield conn.recv()
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve(sys.argv[1] if len(sys.argv) > 1 else os.environ.get("EINK_DAEMON_SOCKET", default_socket))
@@ -1,145 +1,26 @@
-import logging
-import datetime
 import os
-import sys
-import io
-import time
-from pprint import pformat, pprint
 
-from flask import Flask, render_template, jsonify, request, abort
+from flask import Flask, render_template, jsonify, request, abort, Response, stream_with_context
 
-import segno
-from PIL import Image, ImageFont, ImageDraw
+from werkzeug.exceptions import BadRequest, NotFound, TooManyRequests
 
-from werkzeug.exceptions import BadRequest
+from events import sse_stream
 
 app = Flask(__name__)
 version = "0.1.0"
-RaspPI = False
-libdir = ""
 
-# ERROR_CORRECTION = "H"  # can be "l", "M", "Q", "H" (7%, 15%, 25%, 30%=highest correction level)
+# unix socket of a running display_daemon.py. Without it this process owns the panel itself,
+# which only works with a single flask process.
+daemon_socket = os.environ.get("EINK_DAEMON_SOCKET", "")
 
-# display wider side x narrower side in pixel / mm.
-# set display specific settings after posix is identied
-display_dimensions_pixels = (0, 0)
-display_dimensions_mm = (0, 0)
+if daemon_socket:
+    from display_daemon import DaemonClient
 
-# possible settings: 1.54, 2.9
-# connected_display_type = "2.9"
-connected_display_type = "1.54"
+    core = DaemonClient(daemon_socket)
+else:
+    import display_core as core
 
-if os.name == 'posix':
-    libdir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'waveshare')
-    if os.path.exists(libdir):
-        sys.path.append(libdir)
-    if connected_display_type == "1.54":
-        from waveshare import epd1in54 as display
-
-        display_dimensions_mm = (27.60, 27.60)
-        display_dimensions_pixels = (200, 200)
-        font_boot_screen = ImageFont.truetype(os.path.join(libdir, 'Font.ttc'), 22)
-
-    elif connected_display_type == "2.9":
-        from waveshare import epd2in9 as display
-
-        display_dimensions_mm = (66.89, 29.05)
-        display_dimensions_pixels = (296, 128)
-        font_boot_screen = ImageFont.truetype(os.path.join(libdir, 'Font.ttc'), 18)
-
-    RaspPI = True
-
-    fonts = {}
-
-    for c in range(16, 32, 2):
-        fonts[c] = ImageFont.truetype(os.path.join(libdir, 'Font.ttc'), c)
-
-    print("posix detected")
-
-one_mm_wider = display_dimensions_pixels[0] / display_dimensions_mm[0]
-one_cm_wider = round(one_mm_wider * 10)
-one_mm_smaller = display_dimensions_pixels[1] / display_dimensions_mm[1]
-one_cm_smaller = round(one_mm_smaller * 10)
-
-
-def get_ip_addresses(must_include='192.168', debug_log=False):
-    addresses = []
-    try:
-        try:
-            import netifaces
-        except BaseException as e:
-            logging.info(f"kioskstdlib.get_ip_addresses: netifaces module not installed.")
-            return []
-
-        if debug_log:
-            logging.debug(f"get_ip_addresses: Searching network interfaces ...")
-        for dev in netifaces.interfaces():
-            try:
-                if debug_log:
-                    logging.debug(f"get_ip_addresses: Found device {pformat(dev)}:")
-                address = netifaces.ifaddresses(dev)[netifaces.AF_INET]
-                if debug_log:
-                    if address:
-                        logging.debug(f"                  {pformat(address)}")
-                    else:
-                        logging.debug(f"                  No information available.")
-                for part in address:
-                    if 'addr' in part:
-                        if must_include and (part['addr'].find(must_include) > -1):
-                            addresses.append(part['addr'])
-            except BaseException as e:
-                if debug_log:
-                    if "KeyError(2)" in repr(e):
-                        logging.debug(f"                  Device has no IP addresses")
-                    else:
-                        logging.debug(f"                  Could not get more information: {repr(e)} ")
-    except BaseException as e:
-        logging.error(f"kioskstdlib.get_ip_addresses: {repr(e)}")
-
-    if debug_log:
-        logging.debug(f"get_ip_addresses: {len(addresses)} network addresses found.")
-
-    return addresses
-
-
-with app.app_context():
-    addresses = get_ip_addresses()
-    if RaspPI and libdir:
-        epd = display.EPD()
-        print(f"display dimensions: {epd.width}x{epd.height}")
-        logging.info("init and Clear")
-        epd.init(epd.lut_full_update)
-        epd.Clear(0xFF)
-        time.sleep(1)
-        logging.info(f"lib is {libdir}")
-        if epd.width == epd.height:
-            image = Image.new('1', (epd.width, epd.height), 255)  # 255: clear the frame
-        else:
-            image = Image.new('1', (epd.height, epd.width), 255)  # 255: clear the frame
-
-        draw = ImageDraw.Draw(image)
-
-        # draw.rectangle((0, 10, 200, 34), fill=0)
-        line_height = font_boot_screen.size
-        draw.text((8, line_height), f"Kiosk e-Ink Server", font=font_boot_screen, fill=0)
-        draw.text((8, line_height * 2), f"running on IP", font=font_boot_screen, fill=0)
-
-        line = line_height * 3
-        for address in addresses:
-            draw.text((8, line), f"{address}", font=font_boot_screen, fill=0)
-            line += line_height
-
-        line += int(line_height / 2)
-        draw.text((8, line), f"{epd.width} x {epd.height} detected", font=font_boot_screen, fill=0)
-        line += line_height
-        draw.text((8, line), datetime.datetime.now().strftime("%a, %H:%M:%S"), font=font_boot_screen, fill=0)
-        if epd.width == epd.height:
-            epd.display(epd.getbuffer(image.rotate(270)))
-        else:
-            epd.display(epd.getbuffer(image.rotate(180)))
-
-        time.sleep(2)
-        epd.sleep()
+    core.startup()
 
 
 @app.route("/")
@@ -157,245 +38,200 @@ def version_route():
     return response
 
 
-def draw_label(canvas, labels, x, y, font):
-    for c, label in enumerate(labels):
-        label = label.strip('\n\r')
-        canvas.text((x, y + c * font.size), f"{label}",
-                    font=font, fill=0)
+def show_params(form):
+    """
+    :returns: data, labels, display type, font size, scale type and tiles of a /show or /preview request
+    """
+    data = form["data"]
+    labels = form["label"].split("\n")
+    # several data fields (each with its label field) put several codes on one screen
+    tiles = None
+    if len(form.getlist("data")) > 1:
+        tile_labels = form.getlist("label")
+        tiles = [{"data": tile_data, "labels": tile_labels[n].split("\n") if n < len(tile_labels) else []}
+                 for n, tile_data in enumerate(form.getlist("data"))]
+    display_type = None
+    font_size = "auto"
+    scale_type = "auto"
+    try:
+        display_type = form["display-type"]
+        font_size = form["font-size"]
+        scale_type = form["scale-type"]
+    except:
+        pass
+    return data, labels, display_type, font_size, scale_type, tiles
 
 
-def draw_scale(scale_panel, x, y, scale_height, width_cm=2):
-    scale_panel.rectangle((x, y,
-                           x + width_cm * one_cm_wider, y + scale_height), outline=0, fill=255, width=2)
+def job_response(result):
+    response = jsonify(result)
+    if result.get("rejected"):
+        response.status_code = TooManyRequests.code
+        response.headers["Retry-After"] = str(result["retry_after"])
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
 
-    for n in range(0, width_cm * 10, 2):
-        scale_panel.rectangle((x + n * one_mm_wider, y,
-                               x + (n + 1) * one_mm_wider, y + scale_height / 2), outline=0, width=1,
-                              fill=0)
 
-    scale_panel.rectangle((x, y + scale_height / 2,
-                           x + width_cm * one_cm_wider, y + scale_height), outline=0, fill=255, width=2)
+@app.route("/show", methods=['POST'])
+def show_qr_code():
+    if "data" not in request.form:
+        abort(BadRequest.code)
 
-    for n in range(0, int(width_cm * 10 / 2), 10):
-        scale_panel.rectangle((x + n * one_mm_wider, y + scale_height / 2,
-                               x + (n + 5) * one_mm_wider, y + scale_height), outline=0, fill=0)
+    data, labels, display_type, font_size, scale_type, tiles = show_params(request.form)
+    force = request.form.get("force", "").lower() in ["1", "true", "yes"]
+    profile = request.headers.get("X-Profile", request.args.get("profile", "")).lower() in ["1", "true", "yes"]
 
-    for n in range(0, int(width_cm * 10 / 2), 20):
-        scale_panel.rectangle((x + int(width_cm / 2) * one_cm_wider + n * one_mm_wider, y + scale_height / 2,
-                               x + int(width_cm / 2) * one_cm_wider + (n + 10) * one_mm_wider, y + scale_height),
-                              outline=0, fill=0)
+    return job_response(core.show_job(data, labels, display_type, font_size, scale_type, force=force,
+                                      profile=profile, tiles=tiles, client=request.remote_addr))
 
-    # scale_panel.rectangle((x + int(width_cm / 2) * one_cm_wider, y + scale_height / 2,
-    #                        x + one_cm_wider * width_cm, y + scale_height), outline=0, fill=0, width=2)
 
+@app.route("/preview", methods=['GET', 'POST'])
+def preview_route():
+    # the /show parameters as form fields or in the query string
+    if "data" not in request.values:
+        abort(BadRequest.code)
 
-def show_on_square_display(data, font_size, labels, scale_type):
-    img_out = None
-    img_qr_code = None
+    data, labels, display_type, font_size, scale_type, tiles = show_params(request.values)
+    raw = request.values.get("raw", "").lower() in ["1", "true", "yes"]
     try:
-        qrcode = segno.make(data, micro=False)  # , error="H")
-        qrcode_size = qrcode.symbol_size()[0]
-        scale = round(
-            (epd.width - (one_cm_wider * 1.5)) / qrcode_size
-        )
-
-        if font_size == "auto":
-            font_size = 22
-        else:
-            font_size = int(font_size)
-
-        if font_size in fonts:
-            font_label = fonts[font_size]
-        else:
-            if font_size > 0:
-                raise Exception(f'Font size {font_size} not available.')
-            else:
-                font_label = None
-
-        print(f"qrcode size is {qrcode.symbol_size()}")
-        if font_label:
-            print(f"font_size is {font_label.size}")
-        else:
-            print(f"font_size is 0: No identifier.")
-
-        print(f"scale is {scale}")
-
-        out = io.BytesIO()
-        qrcode.save(out, scale=scale, border=0, kind='png')
-        out.seek(0)
-        img_qr_code = Image.open(out)
-        epd.init(epd.lut_full_update)
-        epd.Clear(0xFF)
-        img_out = Image.new('1', (epd.width, epd.height), 255)  # 255: clear the frame
-
-        margin = 3
-
-        canvas = ImageDraw.Draw(img_out)
-        display_height = epd.height
-
-        if scale_type.lower() != "none":
-            if font_label:
-                draw_label(canvas, labels, margin, margin + margin + one_cm_wider * 2, font_label)
-            img_out = img_out.rotate(90)
-            scale_panel = ImageDraw.Draw(img_out)
-            draw_scale(scale_panel, margin, display_height - margin - one_cm_wider / 2, one_cm_wider / 2)
-        else:
-            if font_label:
-                draw_label(canvas, labels, margin, margin + img_qr_code.size[1] + margin, font_label)
-
-
-        img_out.paste(img_qr_code, (margin, margin))
-
-        return img_out.rotate(270)
-    finally:
-        try:
-            if img_qr_code:
-                img_qr_code.close()
-        except:
-            pass
-        try:
-            if img_out:
-                img_out.close()
-        except:
-            pass
-
-
-def show_on_2_9_display(data, font_size, labels, scale_type, display_type):
-    img_out = None
-    img_qr_code = None
-    orientation = "P" if display_type[-1:] == "P" else "L"
-    print(f"orientation is {orientation}")
-
-    qrcode = segno.make(data, micro=False)  # , error="H")
-    qrcode_size = qrcode.symbol_size()[0]
-
-    if orientation == "P":
-        display_width = display_dimensions_pixels[1]
-        display_height = display_dimensions_pixels[0]
+        png = core.preview(data, labels, display_type, font_size, scale_type, tiles=tiles, raw=raw,
+                           client=request.remote_addr)
+    except Exception as e:
+        response = jsonify({"result": False, "msg": repr(e)})
+        response.status_code = BadRequest.code
     else:
-        display_width = display_dimensions_pixels[0]
-        display_height = display_dimensions_pixels[1]
+        if isinstance(png, dict):
+            return job_response(png)
+        response = Response(png, mimetype="image/png")
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
 
-    try:
-        min_dimension = min(display_width, display_height) - one_cm_wider / 2
-        scale = round(
-            min_dimension / qrcode_size
-        )
-
-        if font_size == "auto":
-            font_size = 16
-        else:
-            font_size = int(font_size)
-
-        if font_size in fonts:
-            font_label = fonts[font_size]
-        else:
-            if font_size > 0:
-                raise Exception(f'Font size {font_size} not available.')
-            else:
-                font_label = None
-
-        print(f"qrcode size is {qrcode.symbol_size()}")
-        if font_label:
-            print(f"font_size is {font_label.size}")
-        else:
-            print(f"font_size is 0: No identifier.")
-
-        print(f"scale is {scale}")
-
-        out = io.BytesIO()
-        qrcode.save(out, scale=scale, border=0, kind='png')
-        out.seek(0)
-        img_qr_code = Image.open(out)
-
-        epd.init(epd.lut_full_update)
-        epd.Clear(0xFF)
-
-        img_out = Image.new('1', (display_width, display_height), 255)  # 255: clear the frame
-
-        canvas = ImageDraw.Draw(img_out)
-
-        margin = 3
-
-        scale_end = 0
-        if scale_type.lower() != "none":
-            if orientation == "L":
-                draw_scale(canvas, margin, display_height - margin - one_cm_smaller / 2, one_cm_wider / 2, width_cm=6)
-            else:
-                draw_scale(canvas, margin, margin, one_cm_wider / 2)
-                scale_end = margin + one_cm_wider / 2
-
-        if font_label:
-            if orientation == "P":
-                draw_label(canvas, labels, margin, scale_end + margin + img_qr_code.height, font_label)
-            else:
-                draw_label(canvas, labels, 2 * margin + img_qr_code.width, margin, font_label)
-
-        if orientation == "L":
-            img_out.paste(img_qr_code, (margin, margin))
-        else:
-            img_out.paste(img_qr_code, (margin, int(margin + scale_end)))
-
-        if orientation == "P":
-            return img_out.rotate(0)
-        else:
-
-            return img_out.rotate(180)
-    finally:
-        try:
-            if img_qr_code:
-                img_qr_code.close()
-        except:
-            pass
-        try:
-            if img_out:
-                img_out.close()
-        except:
-            pass
 
+@app.route("/show/region", methods=['POST'])
+def show_region():
+    region = request.form.get("region", "label")
+    if region == "label":
+        if "label" not in request.form:
+            abort(BadRequest.code)
+        value = request.form["label"].split("\n")
+    elif region == "qr":
+        if "data" not in request.form:
+            abort(BadRequest.code)
+        value = request.form["data"]
+    else:
+        value = request.form.get("scale-type", "auto")
 
-@app.route("/show", methods=['POST'])
-def show_qr_code():
-    if "data" not in request.form:
+    return job_response(core.show_region_job(region, value, client=request.remote_addr))
+
+
+@app.route("/status")
+def status_route():
+    response = jsonify(core.status())
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+
+@app.route("/layouts")
+def layouts_route():
+    try:
+        version = int(request.args["version"]) if "version" in request.args else None
+    except ValueError:
         abort(BadRequest.code)
+    response = jsonify(core.layout_table(version, request.args.get("orientation", None)))
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
 
-    data = request.form["data"]
-    labels = request.form["label"].split("\n")
-    display_type = connected_display_type
-    font_size = "auto"
-    scale_type = "auto"
+
+@app.route("/debug/profiles")
+def profiles_route():
+    response = jsonify(core.list_profiles())
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+
+@app.route("/debug/profiles/<name>")
+def profile_route(name):
+    summary = request.args.get("format", "") == "txt"
+    content = core.read_profile(name, summary)
+    if content is None:
+        abort(NotFound.code)
+
+    if summary:
+        return Response(content, mimetype="text/plain")
+    return Response(content, mimetype="application/octet-stream",
+                    headers={"Content-Disposition": f"attachment; filename={name}"})
+
+
+@app.route("/debug/recent")
+def recent_route():
     try:
-        display_type = request.form["display-type"]
-        font_size = request.form["font-size"]
-        scale_type = request.form["scale-type"]
-    except:
-        pass
+        count = int(request.args.get("n", "100"))
+    except ValueError:
+        abort(BadRequest.code)
+    level = request.args.get("level", "DEBUG").upper()
+    if count < 0 or level not in ["DEBUG", "INFO", "WARNING", "ERROR"]:
+        abort(BadRequest.code)
+
+    response = jsonify(core.recent_events(count, level))
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
 
-    print(f"display_type: {display_type}, font_size: {font_size}, scale_type: {scale_type}")
-    rc = True
-    msg = ""
-    img = None
+@app.route("/debug/memory")
+def memory_route():
+    response = jsonify(core.memory_report())
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+
+def memory_query_args():
     try:
-        if not display_type.startswith(connected_display_type):
-            raise Exception(f"requested display type {display_type} different from connected {connected_display_type}.")
-
-        if connected_display_type in ["1.54"]:
-            img = show_on_square_display(data, font_size, labels, scale_type)
-        elif connected_display_type in ["2.9"]:
-            img = show_on_2_9_display(data, font_size, labels, scale_type, display_type)
-
-        if img:
-            epd.display(epd.getbuffer(img))
-        else:
-            raise Exception('No image to show.')
-
-    except BaseException as e:
-        logging.error(f"show_qr_code: Exception {repr(e)}")
-        rc = False
-        msg = repr(e)
-
-    response = jsonify({"result": rc,
-                        "msg": msg})
+        count = int(request.args.get("top", "20"))
+    except ValueError:
+        abort(BadRequest.code)
+    key_type = request.args.get("by", "lineno")
+    if count < 0 or key_type not in ["lineno", "filename", "traceback"]:
+        abort(BadRequest.code)
+    return count, key_type
+
+
+@app.route("/debug/memory/snapshots", methods=['POST', 'DELETE'])
+def memory_snapshots_route():
+    if request.method == "POST":
+        result = core.memory_snapshot()
+    else:
+        result = core.memory_stop_tracing()
+    response = jsonify(result)
     response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
 
+
+@app.route("/debug/memory/snapshots/<name>")
+def memory_snapshot_route(name):
+    count, key_type = memory_query_args()
+    if "diff" in request.args:
+        result = core.memory_diff(request.args["diff"], name, count, key_type)
+    else:
+        result = core.memory_top(name, count, key_type)
+    if result is None:
+        abort(NotFound.code)
+
+    response = jsonify(result)
+    response.headers.add('Access-Control-Allow-Origin', '*')
     return response
+
+
+@app.route("/events")
+def events_route():
+    last_event_id = request.headers.get("Last-Event-ID", None)
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+
+    events = core.subscribe(last_event_id)
+    response = Response(stream_with_context(sse_stream(events)), mimetype="text/event-stream")
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    response.headers.add('Cache-Control', 'no-cache')
+    response.headers.add('X-Accel-Buffering', 'no')
+    return response
+
@@ -0,0 +1,99 @@
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from collections import deque
+
+# Structured event log: every event goes into an in-memory ring (served by /debug/recent). Events at or above
+# the file level are also written as json lines to a rotating file, but by a background thread and rate limited,
+# so that a request never waits for the SD card.
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+levels = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+
+
+class EventLog:
+
+    def __init__(self, ring_size=500, file_name="", file_level=INFO, max_rate=20, max_bytes=1024 * 1024,
+                 backup_count=3):
+        """
+        :param file_name: the file sink. No file is written if empty.
+        :param max_rate: maximum number of events per second written to the file, the rest is only counted
+        """
+        self._ring = deque(maxlen=ring_size)
+        self._lock = threading.Lock()
+        self.file_level = file_level
+        self.max_rate = max_rate
+        self._tokens = float(max_rate)
+        self._last_refill = time.monotonic()
+        self.dropped = 0
+        self._queue = None
+        if file_name:
+            self._handler = logging.handlers.RotatingFileHandler(file_name, maxBytes=max_bytes,
+                                                                 backupCount=backup_count)
+            self._handler.setFormatter(logging.Formatter("%(message)s"))
+            self._queue = queue.Queue(maxsize=1000)
+            threading.Thread(target=self._write_loop, name="eventlog", daemon=True).start()
+
+    def log(self, level, event, **fields):
+        record = {"ts": round(time.time(), 3), "level": logging.getLevelName(level), "event": event}
+        record.update(fields)
+        with self._lock:
+            self._ring.append(record)
+            if self._queue is None or level < self.file_level or not self._take_token():
+                if self._queue is not None and level >= self.file_level:
+                    self.dropped += 1
+                return
+        try:
+            self._queue.put_nowait((level, record))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+    def _take_token(self):
+        now = time.monotonic()
+        self._tokens = min(float(self.max_rate), self._tokens + (now - self._last_refill) * self.max_rate)
+        self._last_refill = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _write_loop(self):
+        while True:
+            level, record = self._queue.get()
+            try:
+                self._handler.emit(logging.LogRecord("events", level, "", 0, json.dumps(record, default=str),
+                                                     None, None))
+            except BaseException as e:
+                logging.error(f"EventLog._write_loop: {repr(e)}")
+
+    def recent(self, count=100, min_level=DEBUG):
+        """
+        :returns: the newest count events at or above min_level, oldest first
+        """
+        with self._lock:
+            records = [r for r in self._ring if levels[r["level"]] >= min_level]
+        return records[-count:] if count else []
+
+    def stats(self):
+        with self._lock:
+            return {"ring": len(self._ring), "dropped": self.dropped}
@@ -0,0 +1,101 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+
+class EventBus:
+    """
+    fans out display pipeline events to any number of subscribers (e.g. /events SSE streams).
+    A slow subscriber never blocks the publisher: if its queue is full the oldest event is dropped.
+    """
+
+    def __init__(self, max_queued=100, history=50, sink=None):
+        """
+        :param sink: optional callable that gets every published event, e.g. to record it in the event log
+        """
+        self._lock = threading.Lock()
+        self._sink = sink
+        self._subscribers = []
+        self._history = deque(maxlen=history)
+        self._next_id = 1
+        self.max_queued = max_queued
+
+    def subscribe(self, last_event_id=None):
+        q = queue.Queue(maxsize=self.max_queued)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._history:
+                    if event["id"] > last_event_id:
+                        self._put(q, event)
+            self._subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            if q in self._subscribers:
+                self._subscribers.remove(q)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event_type, **data):
+        with self._lock:
+            event = {"id": self._next_id,
+                     "event": event_type,
+                     "ts": round(time.time(), 3),
+                     "data": data}
+            self._next_id += 1
+            self._history.append(event)
+            for q in self._subscribers:
+                self._put(q, event)
+        if self._sink:
+            self._sink(event)
+        return event
+
+    @staticmethod
+    def _put(q, event):
+        try:
+            q.put_nowait(event)
+        except queue.Full:
+            try:
+                q.get_nowait()
+                q.put_nowait(event)
+            except (queue.Empty, queue.Full):
+                pass
+
+    def listen(self, q, heartbeat=15):
+        """
+        generator over the events of a subscriber queue. Yields None every heartbeat seconds without events,
+        so that dead connections get noticed. Unsubscribes when the generator is closed.
+        """
+        try:
+            while True:
+                try:
+                    yield q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield None
+        finally:
+            self.unsubscribe(q)
+            logging.debug("EventBus.listen: subscriber disconnected")
+
+
+def sse_stream(events):
+    """
+    turns a generator of events (see EventBus.listen) into server-sent-event text.
+    """
+    try:
+        yield "retry: 3000\n\n"
+        for event in events:
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            payload = dict(event["data"])
+            payload["ts"] = event["ts"]
+            yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(payload)}\n\n"
+    finally:
+        events.close()
@@ -0,0 +1,174 @@
+import atexit
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+# Content-addressed store of packed panel frames that survives restarts. The file has a fixed number of
+# fixed-size records and is memory mapped. New frames are collected and written in batches to the records
+# after the newest one, like a ring log, so the oldest frames are evicted first and the SD card sees few,
+# sequential writes.
+
+MAGIC = b"EFS1"
+FILE_HEADER = struct.Struct("!4sII")          # magic, record count, frame size
+RECORD_HEADER = struct.Struct("!4s20sIII")    # magic, key, sequence number, frame length, crc32 of the frame
+
+# part of every key: bump it whenever rendering.py, compositor.py or qrencoding.py draw a request differently, so
+# that frames rendered by an older version are not served from the store after an update
+RENDER_VERSION = 2
+
+
+def frame_key(params, driver):
+    """
+    :returns: the key of the frame rendered from the request parameters on a panel driver
+    """
+    return hashlib.sha1(json.dumps([RENDER_VERSION, driver, params], sort_keys=True).encode("utf-8")).digest()
+
+
+class FrameStore:
+
+    def __init__(self, file_name, frame_size, records=500, batch_size=8, flush_interval=30):
+        """
+        :param records: capacity of the store, the file takes records * (frame_size + 40) bytes
+        :param batch_size: number of new frames that are written together
+        :param flush_interval: seconds after which new frames are written anyway
+        """
+        self.file_name = file_name
+        self.frame_size = frame_size
+        self.records = records
+        self.record_size = RECORD_HEADER.size + frame_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._index = {}
+        self._pending = {}
+        self._next_slot = 0
+        self._next_seq = 1
+        self.hits = 0
+        self.misses = 0
+        self.written = 0
+
+        self._open()
+        self._load_index()
+        self._flush_event = threading.Event()
+        threading.Thread(target=self._flush_loop, name="framestore", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _open(self):
+        size = FILE_HEADER.size + self.records * self.record_size
+        new = True
+        if os.path.exists(self.file_name) and os.path.getsize(self.file_name) == size:
+            with open(self.file_name, "rb") as f:
+                header = f.read(FILE_HEADER.size)
+            new = header != FILE_HEADER.pack(MAGIC, self.records, self.frame_size)
+        if new:
+            # a new store or one with another record layout
+            with open(self.file_name, "wb") as f:
+                f.write(FILE_HEADER.pack(MAGIC, self.records, self.frame_size))
+                f.truncate(size)
+            logging.info(f"FrameStore: created {self.file_name} for {self.records} frames")
+        self._file = open(self.file_name, "r+b")
+        self._mm = mmap.mmap(self._file.fileno(), size)
+
+    def _offset(self, slot):
+        return FILE_HEADER.size + slot * self.record_size
+
+    def _load_index(self):
+        newest = (0, -1)
+        for slot in range(self.records):
+            offset = self._offset(slot)
+            magic, key, seq, length, crc = RECORD_HEADER.unpack_from(self._mm, offset)
+            if magic != MAGIC or length > self.frame_size:
+                continue
+            start = offset + RECORD_HEADER.size
+            if zlib.crc32(self._mm[start:start + length]) != crc:
+                # torn write, e.g. power cut during a flush
+                continue
+            old = self._index.get(key)
+            if old is None or old[1] < seq:
+                self._index[key] = (slot, seq)
+            newest = max(newest, (seq, slot))
+        self._next_seq = newest[0] + 1
+        self._next_slot = (newest[1] + 1) % self.records
+        logging.info(f"FrameStore: {len(self._index)} frames in {self.file_name}")
+
+    def get(self, key, count=True):
+        """
+        :param count: count the lookup in the hits and misses
+        :returns: the frame as bytes or None
+        """
+        with self._lock:
+            frame = self._pending.get(key)
+            if frame is None and key in self._index:
+                slot, seq = self._index[key]
+                offset = self._offset(slot)
+                magic, stored_key, stored_seq, length, crc = RECORD_HEADER.unpack_from(self._mm, offset)
+                if stored_key == key and stored_seq == seq:
+                    frame = self._mm[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if count and frame is None:
+                self.misses += 1
+            elif count:
+                self.hits += 1
+            return frame
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._pending or key in self._index
+
+    def put(self, key, frame):
+        if len(frame) > self.frame_size:
+            return
+        with self._lock:
+            if key in self._index or key in self._pending:
+                return
+            self._pending[key] = bytes(frame)
+            if len(self._pending) >= self.batch_size:
+                self._flush_event.set()
+
+    def flush(self):
+        """
+        writes the pending frames to the records after the newest one, payload before header.
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            for key, frame in self._pending.items():
+                slot = self._next_slot
+                offset = self._offset(slot)
+                # the record is overwritten: forget the frame it held
+                magic, old_key, old_seq, length, crc = RECORD_HEADER.unpack_from(self._mm, offset)
+                if magic == MAGIC and self._index.get(old_key, (None, None))[0] == slot:
+                    del self._index[old_key]
+
+                self._mm[offset:offset + RECORD_HEADER.size] = b"\0" * RECORD_HEADER.size
+                self._mm[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + len(frame)] = frame
+                RECORD_HEADER.pack_into(self._mm, offset, MAGIC, key, self._next_seq, len(frame),
+                                        zlib.crc32(frame))
+                self._index[key] = (slot, self._next_seq)
+                self._next_seq += 1
+                self._next_slot = (slot + 1) % self.records
+                self.written += 1
+            self._pending.clear()
+            self._mm.flush()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except BaseException as e:
+                logging.error(f"FrameStore._flush_loop: {repr(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {"frames": len(self._index),
+                    "pending": len(self._pending),
+                    "capacity": self.records,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "written": self.written}
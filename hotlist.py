@@ -0,0 +1,97 @@
+import atexit
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+# Frequency and recency of the rendered requests. The hottest ones are saved to a small json file, so that
+# their frames can be rendered in the background after the next start (see display_core.warm_up).
+
+
+class HotList:
+
+    def __init__(self, file_name, max_entries=200, half_life_days=7, save_interval=600):
+        """
+        :param half_life_days: a request counts half as much after this many days
+        :param save_interval: seconds between saves, the list is also saved at exit
+        """
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.half_life = half_life_days * 24 * 3600
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._changed = False
+        self.load()
+        threading.Thread(target=self._save_loop, name="hotlist", daemon=True).start()
+        atexit.register(self.save)
+
+    def score(self, entry, now=None):
+        age = (now or time.time()) - entry["last"]
+        return entry["count"] * math.pow(0.5, age / self.half_life)
+
+    def record(self, key, params):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {"params": params, "count": 0, "last": 0}
+            entry["count"] += 1
+            entry["last"] = time.time()
+            self._changed = True
+            if len(self._entries) > 2 * self.max_entries:
+                self._trim()
+
+    def _trim(self):
+        now = time.time()
+        hottest = sorted(self._entries.items(), key=lambda item: self.score(item[1], now), reverse=True)
+        self._entries = dict(hottest[:self.max_entries])
+
+    def top(self, count=None):
+        """
+        :returns: the params of the hottest requests, hottest first
+        """
+        with self._lock:
+            now = time.time()
+            entries = sorted(self._entries.values(), key=lambda entry: self.score(entry, now), reverse=True)
+        return [entry["params"] for entry in entries[:count or self.max_entries]]
+
+    def load(self):
+        if not os.path.exists(self.file_name):
+            return
+        try:
+            with open(self.file_name) as f:
+                entries = json.load(f)
+            with self._lock:
+                self._entries = {entry["key"]: {"params": entry["params"],
+                                                "count": entry["count"],
+                                                "last": entry["last"]} for entry in entries}
+            logging.info(f"HotList: {len(self._entries)} entries loaded from {self.file_name}")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.error(f"HotList.load: {self.file_name} ignored: {repr(e)}")
+
+    def save(self):
+        with self._lock:
+            if not self._changed:
+                return
+            self._trim()
+            entries = [dict(entry, key=key) for key, entry in self._entries.items()]
+            self._changed = False
+        # write a new file and rename it, so that a power cut never leaves a half written list
+        tmp = self.file_name + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(entries, f, separators=(",", ":"))
+            os.replace(tmp, self.file_name)
+        except OSError as e:
+            logging.error(f"HotList.save: {repr(e)}")
+
+    def _save_loop(self):
+        while True:
+            time.sleep(self.save_interval)
+            self.save()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries)}
@@ -0,0 +1,47 @@
+import datetime
+
+from PIL import Image, ImageDraw
+
+from waveshare.packing import pack_image
+
+# The idle screen: IP addresses, time, queue depth and the last job. Every item has its own line at a fixed
+# position, so a change only touches the rows of its line and can be shown with a partial refresh of a small
+# window (see display_core.refresh_idle_screen).
+
+
+def describe_job(last_job):
+    """
+    :param last_job: dict with job, result and time (epoch seconds) or None
+    """
+    if not last_job:
+        return "no job yet"
+    time_of_day = datetime.datetime.fromtimestamp(last_job["time"]).strftime("%H:%M")
+    return f"job {last_job['job']} {'ok' if last_job['result'] else 'failed'} {time_of_day}"
+
+
+def draw(fields, width, height, font):
+    """
+    :param fields: dict with addresses (list), time, queue and last_job (strings). time and queue may be None.
+    :param width, height: size of the panel RAM
+    :returns: the idle screen packed for the panel
+    """
+    square = width == height
+    image = Image.new('1', (width, height) if square else (height, width), 255)
+    draw = ImageDraw.Draw(image)
+
+    line_height = font.size
+    line = int(line_height / 2)
+    draw.text((8, line), "Kiosk e-Ink Server", font=font, fill=0)
+    line += line_height
+    for address in fields["addresses"] or ["no network"]:
+        draw.text((8, line), address, font=font, fill=0)
+        line += line_height
+
+    line += int(line_height / 2)
+    for key in ["time", "queue", "last_job"]:
+        if fields.get(key) is not None:
+            text = f"queue {fields[key]}" if key == "queue" else fields[key]
+            draw.text((8, line), text, font=font, fill=0)
+            line += line_height
+
+    return pack_image(image.rotate(270 if square else 180), width, height)
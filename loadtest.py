@@ -0,0 +1,270 @@
+"""
+load and soak test for /show.
+
+Run the server on the simulated panel backend (see waveshare/epdconfig.py), e.g.
+
+    EINK_SIMULATED_PANEL=1 flask run
+
+and replay a trace against it:
+
+    python loadtest.py --rate 0.5 --duration 28800 http://localhost:5000
+
+Without --trace a realistic trace of a photo table is generated: bursts of objects, repeated requests,
+varying label lengths and, on a 2.9" panel, both orientations. --save-trace writes it as json lines, so that
+the same trace can be replayed later. Requests are sent open loop at their scheduled time, so latencies include
+the time a request waits for a free client thread.
+
+The report has p50/p95/p99 end-to-end latency, the server's render and queue wait times, panel refreshes
+performed versus requested and the memory growth of the server over the run.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def generate_trace(duration, rate, display_type="1.54", seed=None):
+    """
+    :param rate: average number of requests per second
+    :returns: list of requests, each a dict with the offset t in seconds and the /show form fields
+    """
+    rng = random.Random(seed)
+    orientations = ["2.9", "2.9P"] if display_type.startswith("2.9") else [display_type]
+    trace = []
+    t = 0.0
+    unit = 1
+    previous = None
+    while True:
+        t += rng.expovariate(rate)
+        if t >= duration:
+            break
+
+        if previous and rng.random() < 0.15:
+            # the same object posted again
+            trace.append(dict(previous, t=round(t, 3)))
+            continue
+
+        # a burst: several objects of one context photographed in a row
+        burst = rng.choice([1, 1, 1, 2, 3, 5])
+        for n in range(burst):
+            identifier = f"FA-{unit:03d}-{rng.randint(1, 99):02d}"
+            lines = [identifier] + [" ".join(rng.choice(["photographed", "sherd", "bone", "context", "north",
+                                                         "profile", "detail", "sample", "find"])
+                                             for _ in range(rng.randint(1, 5)))
+                                    for _ in range(rng.randint(0, 2))]
+            previous = {"t": round(t + n * rng.uniform(0.2, 1.0), 3),
+                        "data": identifier,
+                        "label": "\n".join(lines),
+                        "display-type": rng.choice(orientations),
+                        "font-size": "auto",
+                        "scale-type": rng.choice(["auto", "auto", "none"])}
+            trace.append(previous)
+        unit += 1
+
+    return sorted(trace, key=lambda r: r["t"])
+
+
+def load_trace(file_name):
+    with open(file_name) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_trace(trace, file_name):
+    with open(file_name, "w") as f:
+        for r in trace:
+            f.write(json.dumps(r) + "\n")
+
+
+def get_json(url, timeout=30):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def post_show(base_url, fields, timeout=120):
+    form = {k: v for k, v in fields.items() if k != "t"}
+    data = urllib.parse.urlencode(form).encode("utf-8")
+    try:
+        with urllib.request.urlopen(f"{base_url}/show", data=data, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, {}
+    except OSError as e:
+        print(f"request failed: {repr(e)}", file=sys.stderr)
+        return 0, {}
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Monitor:
+    """
+    polls /status during the run to sample the memory of the server.
+    """
+
+    def __init__(self, base_url, interval):
+        self.base_url = base_url
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.thread.join()
+        self.sample()
+
+    def sample(self):
+        try:
+            status = get_json(f"{self.base_url}/status")
+            self.samples.append((time.time(), status.get("process", {})))
+        except (OSError, ValueError) as e:
+            print(f"status failed: {repr(e)}", file=sys.stderr)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+def run(base_url, trace, concurrency=8, speed=1.0, sample_interval=60, progress=True):
+    """
+    replays the trace against the server.
+    :param speed: replay speed factor, 2 sends the trace in half the time
+    :returns: the report as dict
+    """
+    results = []
+    lock = threading.Lock()
+    status_before = get_json(f"{base_url}/status")
+    monitor = Monitor(base_url, sample_interval)
+    monitor.sample()
+    monitor.start()
+
+    def send(scheduled, fields):
+        code, answer = post_show(base_url, fields)
+        finished = time.time()
+        with lock:
+            results.append({"latency_ms": (finished - scheduled) * 1000,
+                            "code": code,
+                            "result": answer.get("result", False),
+                            "skipped": answer.get("skipped", False),
+                            "timings": answer.get("timings", {})})
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i, fields in enumerate(trace):
+            scheduled = start + fields["t"] / speed
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, scheduled, fields)
+            if progress and i and i % 100 == 0:
+                print(f"{i}/{len(trace)} requests sent", file=sys.stderr)
+
+    monitor.stop()
+    status_after = get_json(f"{base_url}/status")
+    return report(results, status_before, status_after, monitor.samples, time.time() - start)
+
+
+def report(results, status_before, status_after, memory_samples, duration):
+    latencies = [r["latency_ms"] for r in results]
+    waits = [r["timings"]["wait_ms"] for r in results if "wait_ms" in r["timings"]]
+    render_ms = [r["timings"]["render_ms"] for r in results if "render_ms" in r["timings"]]
+
+    def delta(section, key):
+        return status_after.get(section, {}).get(key, 0) - status_before.get(section, {}).get(key, 0)
+
+    # without psutil the server only reports its peak rss
+    rss = [(ts, s.get("rss_kb", s.get("max_rss_kb"))) for ts, s in memory_samples
+           if "rss_kb" in s or "max_rss_kb" in s]
+    memory = {}
+    if len(rss) > 1:
+        hours = (rss[-1][0] - rss[0][0]) / 3600
+        memory = {"rss_start_kb": rss[0][1],
+                  "rss_end_kb": rss[-1][1],
+                  "rss_max_kb": max(kb for _, kb in rss),
+                  "growth_kb_per_hour": round((rss[-1][1] - rss[0][1]) / hours) if hours else 0}
+    workers = [s["workers_rss_kb"] for _, s in memory_samples if "workers_rss_kb" in s]
+    if workers:
+        memory["workers_rss_start_kb"] = workers[0]
+        memory["workers_rss_end_kb"] = workers[-1]
+
+    return {
+        "duration_s": round(duration, 1),
+        "requests": len(results),
+        "errors": sum(1 for r in results if r["code"] != 429 and (r["code"] != 200 or not r["result"])),
+        "rejected": sum(1 for r in results if r["code"] == 429),
+        "latency_ms": {f"p{p}": round(percentile(latencies, p), 1) for p in [50, 95, 99]},
+        "latency_max_ms": round(max(latencies), 1) if latencies else 0,
+        "render_ms": {f"p{p}": round(percentile(render_ms, p), 1) for p in [50, 95, 99]},
+        "queue_wait_ms": {"render_pool": status_after.get("render_pool", {}).get("avg_queue_wait_ms", 0),
+                          "hardware": status_after.get("hardware", {}).get("avg_queue_wait_ms", 0),
+                          "panel": {f"p{p}": round(percentile(waits, p), 1) for p in [50, 95, 99]}},
+        "refreshes": {"requested": len(results),
+                      "skipped": sum(1 for r in results if r["skipped"]),
+                      "panel_refreshes": delta("panel", "refreshes")},
+        "bytes_sent": delta("panel", "bytes_sent"),
+        "memory": memory,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load and soak test for /show")
+    parser.add_argument("url", nargs="?", default="http://localhost:5000")
+    parser.add_argument("--trace", help="replay this trace (json lines) instead of generating one")
+    parser.add_argument("--save-trace", help="write the trace to this file")
+    parser.add_argument("--rate", type=float, default=0.5, help="requests per second of the generated trace")
+    parser.add_argument("--duration", type=float, default=600, help="seconds of the generated trace")
+    parser.add_argument("--display-type", default="1.54")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of client threads")
+    parser.add_argument("--sample-interval", type=float, default=60, help="seconds between memory samples")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = generate_trace(args.duration, args.rate, args.display_type, args.seed)
+    if args.save_trace:
+        save_trace(trace, args.save_trace)
+
+    result = run(args.url.rstrip("/"), trace, args.concurrency, args.speed, args.sample_interval)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"{result['requests']} requests in {result['duration_s']} s, {result['errors']} errors, "
+          f"{result['rejected']} rejected (429)")
+    print("latency ms:   " + ", ".join(f"{k} {v}" for k, v in result["latency_ms"].items())
+          + f", max {result['latency_max_ms']}")
+    print("render ms:    " + ", ".join(f"{k} {v}" for k, v in result["render_ms"].items()))
+    print(f"queue wait:   render pool {result['queue_wait_ms']['render_pool']} ms, "
+          f"hardware {result['queue_wait_ms']['hardware']} ms (averages since server start)")
+    print("panel wait:   " + ", ".join(f"{k} {v}" for k, v in result["queue_wait_ms"]["panel"].items()) + " ms")
+    refreshes = result["refreshes"]
+    print(f"refreshes:    {refreshes['requested']} requested, {refreshes['skipped']} skipped, "
+          f"{refreshes['panel_refreshes']} panel refreshes, {result['bytes_sent']} bytes sent")
+    if result["memory"]:
+        memory = result["memory"]
+        print(f"memory:       rss {memory['rss_start_kb']} -> {memory['rss_end_kb']} kB "
+              f"(max {memory['rss_max_kb']} kB, {memory['growth_kb_per_hour']} kB/h)")
+    else:
+        print("memory:       not reported by the server")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import collections
+import gc
+import itertools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+# Memory instrumentation for /debug/memory: sizes of the caches, garbage collector counts and tracemalloc
+# snapshots. Tracing starts with the first snapshot and stops on request, because it slows down every allocation
+# and needs memory of its own.
+
+# number of stack frames stored per traced allocation and number of snapshots kept
+trace_frames = int(os.environ.get("EINK_TRACE_FRAMES", "10"))
+max_snapshots = 8
+
+key_types = ["lineno", "filename", "traceback"]
+
+_snapshots = collections.OrderedDict()
+_snapshot_counter = itertools.count(1)
+_lock = threading.Lock()
+
+# tracemalloc's own allocations and the import machinery are noise in every snapshot
+_noise = [tracemalloc.Filter(False, tracemalloc.__file__),
+          tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+          tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+          tracemalloc.Filter(False, "<unknown>")]
+
+_opaque = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+           threading.Thread)
+
+
+def deep_size(obj):
+    """
+    :returns: the size in bytes of the object and everything it holds in containers and instance attributes.
+              Classes, modules, functions and threads are not followed.
+    """
+    seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        item = pending.pop()
+        if id(item) in seen or isinstance(item, _opaque):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, collections.deque)):
+            pending.extend(item)
+        elif hasattr(item, "__dict__"):
+            pending.append(item.__dict__)
+    return size
+
+
+def count_instances(cls):
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, cls))
+
+
+def gc_stats():
+    return {"objects": len(gc.get_objects()),
+            "pending": gc.get_count(),
+            "collections": [generation["collections"] for generation in gc.get_stats()],
+            "uncollectable": len(gc.garbage)}
+
+
+def tracing_stats():
+    stats = {"tracing": tracemalloc.is_tracing(), "snapshots": list_snapshots()}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        stats.update({"traced_kb": current // 1024,
+                      "traced_peak_kb": peak // 1024,
+                      "overhead_kb": tracemalloc.get_tracemalloc_memory() // 1024})
+    return stats
+
+
+def list_snapshots():
+    with _lock:
+        return [{"name": name, "created": created} for name, (created, snapshot) in _snapshots.items()]
+
+
+def take_snapshot():
+    """
+    starts tracing if it is off. Only allocations made after the start are in a snapshot, so the first snapshot
+    is a baseline for the following ones.
+    :returns: name, creation time and traced memory of the snapshot
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(trace_frames)
+    snapshot = tracemalloc.take_snapshot().filter_traces(_noise)
+    with _lock:
+        name = f"s{next(_snapshot_counter)}"
+        created = time.time()
+        _snapshots[name] = (created, snapshot)
+        while len(_snapshots) > max_snapshots:
+            _snapshots.popitem(last=False)
+    return {"name": name,
+            "created": created,
+            "traced_kb": sum(stat.size for stat in snapshot.statistics("filename")) // 1024}
+
+
+def stop_tracing():
+    """
+    stops tracing and drops all snapshots.
+    """
+    tracemalloc.stop()
+    with _lock:
+        _snapshots.clear()
+
+
+def _site(traceback, key_type):
+    if key_type == "traceback":
+        return [f"{frame.filename}:{frame.lineno}" for frame in traceback]
+    frame = traceback[0]
+    return frame.filename if key_type == "filename" else f"{frame.filename}:{frame.lineno}"
+
+
+def _get_snapshot(name):
+    with _lock:
+        entry = _snapshots.get(name)
+    return entry[1] if entry else None
+
+
+def top_allocations(name, count=20, key_type="lineno"):
+    """
+    :param key_type: group the allocations by lineno, filename or traceback
+    :returns: the allocation sites with the most memory in the snapshot or None if there is no such snapshot
+    """
+    snapshot = _get_snapshot(name)
+    if snapshot is None:
+        return None
+    return [{"site": _site(stat.traceback, key_type), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+            for stat in snapshot.statistics(key_type)[:count]]
+
+
+def compare_snapshots(old_name, new_name, count=20, key_type="lineno"):
+    """
+    :returns: the allocation sites that grew or shrank the most between two snapshots or None if one of them
+              does not exist
+    """
+    old, new = _get_snapshot(old_name), _get_snapshot(new_name)
+    if old is None or new is None:
+        return None
+    return [{"site": _site(stat.traceback, key_type),
+             "size_kb": round(stat.size / 1024, 1),
+             "size_diff_kb": round(stat.size_diff / 1024, 1),
+             "count": stat.count,
+             "count_diff": stat.count_diff}
+            for stat in new.compare_to(old, key_type)[:count]]
@@ -0,0 +1,219 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import rendering
+import profiling
+
+
+def _render_in_worker(params, profile=False):
+    started = time.time()
+    if profile:
+        buffer = profiling.run_profiled(rendering.render_frame, **params)
+    else:
+        buffer = rendering.render_frame(**params)
+    return buffer, started, time.time()
+
+
+class RenderPool:
+    """
+    renders frames in a pool of worker processes, so that several requests render in parallel on all cores
+    while the hardware thread is busy with a refresh. With workers=0 frames are rendered in the calling thread.
+    """
+
+    def __init__(self, display_type, workers=None):
+        self.workers = multiprocessing.cpu_count() if workers is None else workers
+        self.display_type = display_type
+        self.executor = None
+        self._lock = threading.Lock()
+        self._restart_lock = threading.Lock()
+        self.restarts = 0
+        self._started = time.time()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.pending = 0
+        self.busy_seconds = 0.0
+        self.queue_wait_seconds = 0.0
+        if rendering.connected_display_type != display_type:
+            rendering.configure(display_type)
+        if self.workers > 0:
+            self.executor = self._start_executor()
+            logging.info(f"RenderPool: {self.workers} render workers started")
+
+    def _start_executor(self):
+        # spawn instead of fork: the server process has threads and may have opened SPI/GPIO
+        executor = ProcessPoolExecutor(max_workers=self.workers,
+                                       mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=rendering.configure,
+                                       initargs=(self.display_type,))
+        for _ in range(self.workers):
+            executor.submit(time.sleep, 0)
+        return executor
+
+    def _submit_to_pool(self, params, profile):
+        executor = self.executor
+        try:
+            return executor.submit(_render_in_worker, params, profile)
+        except BrokenProcessPool:
+            # a worker died (e.g. killed by the OOM killer), which breaks the whole pool: start a new one.
+            # Threads that find the same broken pool restart it only once.
+            with self._restart_lock:
+                if self.executor is executor:
+                    logging.error("RenderPool: a render worker died, restarting the pool")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self.executor = self._start_executor()
+                    with self._lock:
+                        self.restarts += 1
+            return self.executor.submit(_render_in_worker, params, profile)
+
+    def submit(self, profile=False, **params):
+        """
+        :param profile: run the render under the profiler
+        :returns: a Future with the packed frame as result, or the packed frame and the marshalled profiler stats
+        """
+        submitted = time.time()
+        if not self.executor:
+            future = Future()
+            try:
+                future.set_result(_render_in_worker(params, profile))
+            except BaseException as e:
+                future.set_exception(e)
+        else:
+            future = self._submit_to_pool(params, profile)
+
+        # counted once the job is queued: a submit that raises leaves nothing pending, and the callback that
+        # counts the job as done is only added below
+        with self._lock:
+            self.submitted += 1
+            self.pending += 1
+
+        result = Future()
+
+        def done(f):
+            if f.cancelled():
+                with self._lock:
+                    self.pending -= 1
+                result.cancel()
+                return
+            with self._lock:
+                self.pending -= 1
+                if f.exception():
+                    self.failed += 1
+                else:
+                    buffer, started, finished = f.result()
+                    self.completed += 1
+                    self.busy_seconds += finished - started
+                    self.queue_wait_seconds += max(0.0, started - submitted)
+            if f.exception():
+                result.set_exception(f.exception())
+            else:
+                result.set_result(f.result()[0])
+
+        future.add_done_callback(done)
+        return result
+
+    def render(self, **params):
+        return self.submit(**params).result()
+
+    def render_profiled(self, **params):
+        """
+        :returns: the packed frame and the marshalled profiler stats of the render
+        """
+        return self.submit(profile=True, **params).result()
+
+    def render_many(self, param_list):
+        """
+        renders a batch of layouts in parallel.
+        :returns: list of packed frames or exceptions, in the order of param_list
+        """
+        futures = [self.submit(**params) for params in param_list]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BaseException as e:
+                results.append(e)
+        return results
+
+    def stats(self):
+        with self._lock:
+            uptime = time.time() - self._started
+            return {"workers": self.workers,
+                    "queue_depth": self.pending,
+                    "submitted": self.submitted,
+                    "completed": self.completed,
+                    "failed": self.failed,
+                    "restarts": self.restarts,
+                    "avg_render_ms": round(self.busy_seconds * 1000 / self.completed, 1) if self.completed else 0,
+                    "avg_queue_wait_ms": round(self.queue_wait_seconds * 1000 / self.completed, 1)
+                    if self.completed else 0,
+                    "utilization": round(self.busy_seconds / (uptime * max(self.workers, 1)), 4)
+                    if uptime else 0}
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class HardwareThread:
+    """
+    the one thread that talks to the panel. Everything that uses SPI/GPIO is handed to it via run().
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.busy = False
+        self.executed = 0
+        self.busy_seconds = 0.0
+        self.queue_wait_seconds = 0.0
+        self._started = time.time()
+        self.thread = threading.Thread(target=self._loop, name="hardware", daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while True:
+            func, args, kwargs, future, submitted = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.time()
+            with self._lock:
+                self.busy = True
+                self.queue_wait_seconds += start - submitted
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self.busy = False
+                    self.executed += 1
+                    self.busy_seconds += time.time() - start
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self._queue.put((func, args, kwargs, future, time.time()))
+        return future
+
+    def run(self, func, *args, **kwargs):
+        """
+        runs func on the hardware thread and waits for its result
+        """
+        if threading.current_thread() is self.thread:
+            return func(*args, **kwargs)
+        return self.submit(func, *args, **kwargs).result()
+
+    def stats(self):
+        with self._lock:
+            uptime = time.time() - self._started
+            return {"busy": self.busy,
+                    "queue_depth": self._queue.qsize(),
+                    "executed": self.executed,
+                    "avg_queue_wait_ms": round(self.queue_wait_seconds * 1000 / self.executed, 1)
+                    if self.executed else 0,
+                    "utilization": round(self.busy_seconds / uptime, 4) if uptime else 0}
@@ -0,0 +1,109 @@
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import re
+import threading
+import time
+
+# Opt-in profiling of single jobs. Each part of a job (rendering in a worker process, the hardware step on the
+# hardware thread) is profiled where it runs and the parts are merged into one pstats file. The files are kept
+# in a bounded ring on disk.
+
+profile_dir = os.environ.get("EINK_PROFILE_DIR", "/tmp/einkdisplay-profiles")
+max_profiles = int(os.environ.get("EINK_PROFILE_MAX", "20"))
+
+_name_pattern = re.compile(r"^[\w.-]+\.pstats$")
+_lock = threading.Lock()
+
+
+class _LoadedStats:
+    # lets pstats.Stats load marshalled profiler stats without a file
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def run_profiled(func, *args, **kwargs):
+    """
+    :returns: the result of func and the marshalled profiler stats of the call
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(func, *args, **kwargs)
+    profiler.create_stats()
+    return result, marshal.dumps(profiler.stats)
+
+
+def store(job, parts):
+    """
+    merges the marshalled stats of all parts of a job and writes them to the profile ring, together with
+    a text summary.
+    :returns: the name of the profile
+    """
+    parts = [_LoadedStats(marshal.loads(part)) for part in parts if part]
+    if not parts:
+        return None
+
+    stats = pstats.Stats(parts[0])
+    if len(parts) > 1:
+        stats.add(*parts[1:])
+
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-job{job}.pstats"
+    with _lock:
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, name)
+        stats.dump_stats(path)
+
+        summary = io.StringIO()
+        pstats.Stats(path, stream=summary).sort_stats("cumulative").print_stats(40)
+        with open(path[:-len(".pstats")] + ".txt", "w") as f:
+            f.write(summary.getvalue())
+
+        for old in list_profiles()[max_profiles:]:
+            _remove(old["name"])
+
+    logging.info(f"profiling.store: profile of job {job} stored as {name}")
+    return name
+
+
+def _remove(name):
+    for path in [os.path.join(profile_dir, name), os.path.join(profile_dir, name[:-len(".pstats")] + ".txt")]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def list_profiles():
+    """
+    :returns: the stored profiles, newest first
+    """
+    if not os.path.isdir(profile_dir):
+        return []
+
+    profiles = []
+    for name in os.listdir(profile_dir):
+        if _name_pattern.match(name):
+            st = os.stat(os.path.join(profile_dir, name))
+            profiles.append({"name": name, "size": st.st_size, "created": st.st_mtime})
+    return sorted(profiles, key=lambda p: p["created"], reverse=True)
+
+
+def read_profile(name, summary=False):
+    """
+    :param summary: return the text summary instead of the pstats file
+    :returns: the content as bytes or None if there is no such profile
+    """
+    if not _name_pattern.match(name):
+        return None
+    path = os.path.join(profile_dir, name)
+    if summary:
+        path = path[:-len(".pstats")] + ".txt"
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
@@ -0,0 +1,94 @@
+import functools
+import re
+
+import segno
+from segno import consts
+
+# QR encoding of the data of a layout. segno.make encodes the whole data in one mode, so a single lowercase letter
+# puts a long run of digits into byte mode. encode() also tries the data split into numeric, alphanumeric and byte
+# segments with the fewest bits and keeps whichever symbol has the smaller version. segno raises the error
+# correction level as far as the version allows in both cases. The symbols are cached.
+
+encode_cache_size = 256
+
+_error_levels = "LMQH"
+
+_numeric = re.compile(r"[0-9]")
+_alphanumeric = re.compile(r"[0-9A-Z $%*+\-./:]")
+
+# the versions that share the length of the character count indicators, and the lengths of numeric,
+# alphanumeric and byte segments in them
+_count_bits = [(9, (10, 9, 8)), (26, (12, 11, 16)), (40, (14, 13, 16))]
+
+_modes = [consts.MODE_NUMERIC, consts.MODE_ALPHANUMERIC, consts.MODE_BYTE]
+
+
+def _data_bits(mode, length):
+    if mode == consts.MODE_NUMERIC:
+        return length // 3 * 10 + [0, 4, 7][length % 3]
+    if mode == consts.MODE_ALPHANUMERIC:
+        return length // 2 * 11 + 6 * (length % 2)
+    return length * 8
+
+
+def _runs(data):
+    # maximal runs of characters of the same smallest mode: (start, end, mode index)
+    runs = []
+    for n, ch in enumerate(data):
+        mode = 0 if _numeric.match(ch) else 1 if _alphanumeric.match(ch) else 2
+        if runs and runs[-1][2] == mode:
+            runs[-1][1] = n + 1
+        else:
+            runs.append([n, n + 1, mode])
+    return runs
+
+
+def segments(data, count_bits):
+    """
+    splits the data into segments with the fewest bits. Segments start and end where runs of numeric,
+    alphanumeric or other characters do, every segment gets the smallest mode all of its characters allow.
+    :param count_bits: lengths of the numeric, alphanumeric and byte character count indicators
+    :returns: the number of bits and the segments as (text, segno mode) tuples
+    """
+    runs = _runs(data)
+    # best[n]: bits and segments of the cheapest encoding of the first n runs
+    best = [(0, [])] + [None] * len(runs)
+    for end in range(1, len(runs) + 1):
+        mode = 0
+        for start in range(end - 1, -1, -1):
+            mode = max(mode, runs[start][2])
+            text = data[runs[start][0]:runs[end - 1][1]]
+            bits = best[start][0] + 4 + count_bits[mode] + _data_bits(_modes[mode], len(text))
+            if best[end] is None or bits < best[end][0]:
+                best[end] = (bits, best[start][1] + [(text, _modes[mode])])
+    return best[-1]
+
+
+@functools.lru_cache(maxsize=encode_cache_size)
+def encode(data):
+    """
+    :returns: the QR code (segno.QRCode) with the smallest version for the data, never a Micro QR code
+    """
+    qrcode = segno.make(data, micro=False)
+    # mixed segments only pay off if the data mixes character classes, and byte segments are kept in one
+    # encoding so that scanners cannot guess different ones for different segments
+    if not isinstance(data, str) or not data.isascii() or len(_runs(data)) < 2:
+        return qrcode
+
+    single_mode = max(run[2] for run in _runs(data))
+    tried = set()
+    for max_version, count_bits in _count_bits:
+        bits, parts = segments(data, count_bits)
+        single_bits = 4 + count_bits[single_mode] + _data_bits(_modes[single_mode], len(data))
+        if bits >= single_bits or tuple(parts) in tried:
+            continue
+        tried.add(tuple(parts))
+        candidate = segno.make(parts, micro=False)
+        if (candidate.version, -_error_levels.index(candidate.error)) < \
+                (qrcode.version, -_error_levels.index(qrcode.error)):
+            qrcode = candidate
+    return qrcode
+
+
+def cache_info():
+    return encode.cache_info()
@@ -0,0 +1,603 @@
+import functools
+import io
+import logging
+import math
+import os
+
+from PIL import Image, ImageFont, ImageDraw
+
+from waveshare.packing import pack_image
+import compositor
+import qrencoding
+
+# Rendering of the QR code layouts into packed panel frames. Nothing in here touches the hardware,
+# so it can run in render worker processes as well as in the server process.
+
+libdir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'waveshare')
+
+# display wider side x narrower side in pixel / mm. layout selects the show_on_* function.
+display_specs = {
+    "1.54": {"dimensions_mm": (27.60, 27.60), "dimensions_pixels": (200, 200), "boot_font_size": 22,
+             "layout": "square"},
+    "1.54b": {"dimensions_mm": (27.60, 27.60), "dimensions_pixels": (200, 200), "boot_font_size": 22,
+              "layout": "square"},
+    "2.9": {"dimensions_mm": (66.89, 29.05), "dimensions_pixels": (296, 128), "boot_font_size": 18,
+            "layout": "wide"},
+}
+
+connected_display_type = ""
+display_dimensions_pixels = (0, 0)
+display_dimensions_mm = (0, 0)
+one_mm_wider = 0
+one_cm_wider = 0
+one_mm_smaller = 0
+one_cm_smaller = 0
+
+fonts = {}
+font_boot_screen = None
+font_file = ""
+
+# range of font sizes tried by font-size "fit"
+fit_font_sizes = (10, 64)
+
+# tiled screens: at most max_tiles codes, each module at least min_module_mm wide so that the codes stay
+# scannable, and a quiet zone of tile_border modules around every code
+max_tiles = 4
+min_module_mm = 0.25
+tile_border = 1
+
+# advance width of every glyph used so far at metrics_font_size, the widths at other sizes are scaled from it
+metrics_font_size = 100
+glyph_widths = {}
+
+# single codes are composed in the packed panel layout (see compositor.py) if NumPy is installed, PIL draws
+# everything else
+use_compositor = True
+
+# margin around the QR code, the labels and the scale bar in pixels
+margin = 3
+
+# lines of labels in the default font size that the QR code of a layout leaves room for
+label_lines = 2
+
+# the layout of every QR version (1-40) in every orientation of the panel, with and without scale bar.
+# Built by configure(), see compute_layout.
+layouts = {}
+
+
+def configure(display_type):
+    """
+    sets the display specific settings and loads the fonts. Must be called once per process before rendering.
+    """
+    global connected_display_type, display_dimensions_pixels, display_dimensions_mm
+    global one_mm_wider, one_cm_wider, one_mm_smaller, one_cm_smaller, font_boot_screen, font_file
+
+    connected_display_type = display_type
+    display_dimensions_mm = display_specs[display_type]["dimensions_mm"]
+    display_dimensions_pixels = display_specs[display_type]["dimensions_pixels"]
+
+    one_mm_wider = display_dimensions_pixels[0] / display_dimensions_mm[0]
+    one_cm_wider = round(one_mm_wider * 10)
+    one_mm_smaller = display_dimensions_pixels[1] / display_dimensions_mm[1]
+    one_cm_smaller = round(one_mm_smaller * 10)
+
+    font_file = os.path.join(libdir, 'Font.ttc')
+    sized_font.cache_clear()
+    scale_bar_bitmap.cache_clear()
+    glyph_widths.clear()
+    if os.path.exists(font_file):
+        font_boot_screen = ImageFont.truetype(font_file, display_specs[display_type]["boot_font_size"])
+        fonts.clear()
+        for c in range(16, 32, 2):
+            fonts[c] = ImageFont.truetype(font_file, c)
+
+    layouts.clear()
+    for orientation in orientations():
+        for version in range(1, 41):
+            for with_scale in [True, False]:
+                layouts[(orientation, version, with_scale)] = compute_layout(orientation, version, with_scale)
+
+
+def orientations():
+    """
+    :returns: the orientations of the connected display: "S" for a square display, "L" and "P" (landscape and
+              portrait) for a wide one
+    """
+    return ["S"] if display_specs[connected_display_type]["layout"] == "square" else ["L", "P"]
+
+
+def compute_layout(orientation, version, with_scale):
+    """
+    the geometry of a layout in pixels, in the coordinates of the canvas it is drawn on:
+    the module scale, the QR code origin, the label area (origin and size), the scale bar (x, y, height, width in
+    cm or None) and the default font size. In the square layout with scale bar, the labels and the
+    scale bar are drawn on the canvas rotated by 90 degrees, so the label area is given in the unrotated canvas.
+    The module scale is the largest whole number with which the code fits the room left by the labels (at least
+    label_lines lines of the default font size) and the scale bar.
+    """
+    modules = 4 * version + 17
+    label_area = None
+    scale_bar = None
+    if orientation == "S":
+        canvas = display_dimensions_pixels
+        default_font_size = 22
+        qr_origin = (margin, margin)
+        if with_scale:
+            # the labels end up in a column right of the code and the scale bar below it
+            label_origin = (margin, margin + margin + one_cm_wider * 2)
+            scale_bar = (margin, canvas[1] - margin - one_cm_wider / 2, one_cm_wider / 2, 2)
+            qr_extent = min(label_origin[1], scale_bar[1]) - margin - qr_origin[0]
+        else:
+            qr_extent = min(canvas[0] - 2 * margin, canvas[1] - 3 * margin - label_lines * default_font_size)
+        scale = int(qr_extent // modules)
+        qr_px = modules * scale
+        if not with_scale:
+            label_origin = (margin, margin + qr_px + margin)
+    else:
+        if orientation == "P":
+            canvas = (display_dimensions_pixels[1], display_dimensions_pixels[0])
+        else:
+            canvas = display_dimensions_pixels
+        default_font_size = 16
+        scale_end = 0
+        label_bottom = canvas[1] - margin
+        if with_scale:
+            if orientation == "L":
+                scale_bar = (margin, canvas[1] - margin - one_cm_smaller / 2, one_cm_wider / 2, 6)
+                label_bottom = scale_bar[1] - margin
+            else:
+                scale_bar = (margin, margin, one_cm_wider / 2, 2)
+                scale_end = margin + one_cm_wider / 2
+        if orientation == "L":
+            # labels right of the code, the scale bar runs below both
+            qr_origin = (margin, margin)
+            qr_extent = min(label_bottom - qr_origin[1],
+                            canvas[0] - 3 * margin - label_lines * default_font_size)
+        else:
+            qr_origin = (margin, int(margin + scale_end))
+            qr_extent = min(canvas[0] - 2 * margin,
+                            label_bottom - qr_origin[1] - label_lines * default_font_size)
+        scale = int(qr_extent // modules)
+        qr_px = modules * scale
+        if orientation == "L":
+            label_origin = (2 * margin + qr_px, margin)
+        else:
+            label_origin = (margin, scale_end + margin + qr_px)
+        label_area = (canvas[0] - margin - label_origin[0], label_bottom - label_origin[1])
+
+    if label_area is None:
+        label_area = (canvas[0] - margin - label_origin[0], canvas[1] - margin - label_origin[1])
+
+    return {"orientation": orientation,
+            "version": version,
+            "with_scale": with_scale,
+            "canvas": tuple(canvas),
+            "scale": scale,
+            "qr_px": qr_px,
+            "qr_extent": int(qr_extent),
+            "qr_origin": qr_origin,
+            "fits": scale > 0,
+            "label_origin": label_origin,
+            "label_area": label_area,
+            "scale_bar": scale_bar,
+            "default_font_size": default_font_size}
+
+
+def get_layout(qrcode, orientation, scale_type):
+    """
+    :returns: the layout of the code's version
+    :raises ValueError: if not even one pixel per module fits the layout
+    """
+    layout = layouts[(orientation, qrcode.version, scale_type.lower() != "none")]
+    if not layout["fits"]:
+        hint = " Try scale-type none." if layout["with_scale"] and \
+            layouts[(orientation, qrcode.version, False)]["fits"] else ""
+        raise ValueError(f"A QR code of version {qrcode.version} is too large for the display.{hint}")
+    return layout
+
+
+def layout_table():
+    """
+    :returns: all precomputed layouts of the connected display
+    """
+    return [layouts[key] for key in sorted(layouts)]
+
+
+def panel_size():
+    """
+    :returns: width and height of the panel RAM in pixels (the narrower side is the panel's width)
+    """
+    return display_dimensions_pixels[1], display_dimensions_pixels[0]
+
+
+def pack_frame(image):
+    """
+    packs an image into the panel RAM layout, the same packing as EPD.getbuffer (see waveshare/packing.py).
+    """
+    width, height = panel_size()
+    return pack_image(image, width, height)
+
+
+def draw_label(canvas, labels, x, y, font):
+    for c, label in enumerate(labels):
+        label = label.strip('\n\r')
+        canvas.text((x, y + c * font.size), f"{label}",
+                    font=font, fill=0)
+
+
+def draw_scale(scale_panel, x, y, scale_height, width_cm=2):
+    scale_panel.rectangle((x, y,
+                           x + width_cm * one_cm_wider, y + scale_height), outline=0, fill=255, width=2)
+
+    for n in range(0, width_cm * 10, 2):
+        scale_panel.rectangle((x + n * one_mm_wider, y,
+                               x + (n + 1) * one_mm_wider, y + scale_height / 2), outline=0, width=1,
+                              fill=0)
+
+    scale_panel.rectangle((x, y + scale_height / 2,
+                           x + width_cm * one_cm_wider, y + scale_height), outline=0, fill=255, width=2)
+
+    for n in range(0, int(width_cm * 10 / 2), 10):
+        scale_panel.rectangle((x + n * one_mm_wider, y + scale_height / 2,
+                               x + (n + 5) * one_mm_wider, y + scale_height), outline=0, fill=0)
+
+    for n in range(0, int(width_cm * 10 / 2), 20):
+        scale_panel.rectangle((x + int(width_cm / 2) * one_cm_wider + n * one_mm_wider, y + scale_height / 2,
+                               x + int(width_cm / 2) * one_cm_wider + (n + 10) * one_mm_wider, y + scale_height),
+                              outline=0, fill=0)
+
+    # scale_panel.rectangle((x + int(width_cm / 2) * one_cm_wider, y + scale_height / 2,
+    #                        x + one_cm_wider * width_cm, y + scale_height), outline=0, fill=0, width=2)
+
+
+@functools.lru_cache(maxsize=64)
+def sized_font(size):
+    return ImageFont.truetype(font_file, size)
+
+
+def text_width(text, size):
+    """
+    :returns: the width of text at the font size, estimated from the cached glyph widths
+    """
+    total = 0
+    for ch in text:
+        width = glyph_widths.get(ch)
+        if width is None:
+            width = glyph_widths[ch] = sized_font(metrics_font_size).getlength(ch)
+        total += width
+    return total * size / metrics_font_size
+
+
+def fit_font(labels, label_area):
+    """
+    the largest font with which all label lines fit into the label area.
+    The binary search works on the estimated widths, the result is checked once with the real font,
+    which also accounts for kerning.
+    """
+    lines = [label.strip('\n\r') for label in labels] or [""]
+    widest = max(text_width(line, metrics_font_size) for line in lines)
+    width, height = label_area
+
+    low, high = fit_font_sizes
+    size = low
+    while low <= high:
+        middle = (low + high) // 2
+        if len(lines) * middle <= height and widest * middle / metrics_font_size <= width:
+            size = middle
+            low = middle + 1
+        else:
+            high = middle - 1
+
+    font = sized_font(size)
+    while size > fit_font_sizes[0] and max(font.getlength(line) for line in lines) > width:
+        size -= 1
+        font = sized_font(size)
+    return font
+
+
+def get_font(font_size, default_font_size, labels=None, label_area=None):
+    """
+    :param font_size: "auto" for the layout's default size, "fit" for the largest size that fits the label area,
+                      0 for no labels or one of the sizes in fonts
+    :returns: the label font or None if font_size is 0
+    """
+    if font_size == "fit":
+        return fit_font(labels or [], label_area)
+
+    if font_size == "auto":
+        font_size = default_font_size
+    else:
+        font_size = int(font_size)
+
+    if font_size in fonts:
+        return fonts[font_size]
+    if font_size > 0:
+        raise Exception(f'Font size {font_size} not available.')
+    return None
+
+
+def show_on_square_display(data, font_size, labels, scale_type):
+    img_out = None
+    img_qr_code = None
+    try:
+        qrcode = qrencoding.encode(data)
+        layout = get_layout(qrcode, "S", scale_type)
+        font_label = get_font(font_size, layout["default_font_size"], labels, layout["label_area"])
+
+        logging.debug(f"qrcode version is {qrcode.version}, "
+                      f"font_size is {font_label.size if font_label else '0: No identifier'}, "
+                      f"scale is {layout['scale']}")
+
+        out = io.BytesIO()
+        qrcode.save(out, scale=layout["scale"], border=0, kind='png')
+        out.seek(0)
+        img_qr_code = Image.open(out)
+        img_out = Image.new('1', layout["canvas"], 255)  # 255: clear the frame
+
+        canvas = ImageDraw.Draw(img_out)
+
+        if font_label:
+            draw_label(canvas, labels, *layout["label_origin"], font_label)
+        if layout["scale_bar"]:
+            img_out = img_out.rotate(90)
+            scale_panel = ImageDraw.Draw(img_out)
+            x, y, scale_height, width_cm = layout["scale_bar"]
+            draw_scale(scale_panel, x, y, scale_height, width_cm)
+
+        img_out.paste(img_qr_code, layout["qr_origin"])
+
+        return img_out.rotate(270)
+    finally:
+        try:
+            if img_qr_code:
+                img_qr_code.close()
+        except:
+            pass
+        try:
+            if img_out:
+                img_out.close()
+        except:
+            pass
+
+
+def show_on_2_9_display(data, font_size, labels, scale_type, display_type):
+    img_out = None
+    img_qr_code = None
+    orientation = "P" if display_type[-1:] == "P" else "L"
+
+    qrcode = qrencoding.encode(data)
+    layout = get_layout(qrcode, orientation, scale_type)
+
+    try:
+        font_label = get_font(font_size, layout["default_font_size"], labels, layout["label_area"])
+
+        logging.debug(f"orientation is {orientation}, qrcode version is {qrcode.version}, "
+                      f"font_size is {font_label.size if font_label else '0: No identifier'}, "
+                      f"scale is {layout['scale']}")
+
+        out = io.BytesIO()
+        qrcode.save(out, scale=layout["scale"], border=0, kind='png')
+        out.seek(0)
+        img_qr_code = Image.open(out)
+
+        img_out = Image.new('1', layout["canvas"], 255)  # 255: clear the frame
+
+        canvas = ImageDraw.Draw(img_out)
+
+        if layout["scale_bar"]:
+            x, y, scale_height, width_cm = layout["scale_bar"]
+            draw_scale(canvas, x, y, scale_height, width_cm)
+
+        if font_label:
+            draw_label(canvas, labels, *layout["label_origin"], font_label)
+
+        img_out.paste(img_qr_code, layout["qr_origin"])
+
+        if orientation == "P":
+            return img_out.rotate(0)
+        else:
+
+            return img_out.rotate(180)
+    finally:
+        try:
+            if img_qr_code:
+                img_qr_code.close()
+        except:
+            pass
+        try:
+            if img_out:
+                img_out.close()
+        except:
+            pass
+
+
+@functools.lru_cache(maxsize=16)
+def scale_bar_bitmap(canvas_size, scale_bar, rotation):
+    """
+    the scale bar of a layout, drawn once by draw_scale. It is drawn on a white and on a black canvas: the pixels
+    that come out the same in both are the ones the scale bar covers.
+    :returns: the scale bar as opaque compositor bitmap and its position on the canvas
+    """
+    x, y, scale_height, width_cm = scale_bar
+    planes = []
+    for background in [255, 0]:
+        with Image.new('1', canvas_size, background) as image:
+            draw_scale(ImageDraw.Draw(image), x, y, scale_height, width_cm)
+            planes.append(compositor.numpy.array(image))
+    white, black = planes
+    cover = white == black
+    rows = cover.any(axis=1).nonzero()[0]
+    columns = cover.any(axis=0).nonzero()[0]
+    area = (slice(rows[0], rows[-1] + 1), slice(columns[0], columns[-1] + 1))
+    return (compositor.bitmap(~white[area], rotation, cover[area]),
+            int(columns[0]), int(rows[0]))
+
+
+def composable(labels):
+    """
+    :returns: True if the compositor can draw the labels. Lines with a line break are left to ImageDraw.
+    """
+    return use_compositor and compositor.available and not any("\n" in label.strip('\n\r') for label in labels)
+
+
+def compose_code(data, font_size, labels, scale_type, display_type):
+    """
+    composes the same frame as show_on_square_display and show_on_2_9_display directly in the packed panel layout.
+    :returns: the packed frame as bytes
+    """
+    if display_specs[connected_display_type]["layout"] == "square":
+        orientation = "S"
+    else:
+        orientation = "P" if display_type[-1:] == "P" else "L"
+
+    qrcode = qrencoding.encode(data)
+    layout = get_layout(qrcode, orientation, scale_type)
+    font_label = get_font(font_size, layout["default_font_size"], labels, layout["label_area"])
+
+    logging.debug(f"orientation is {orientation}, qrcode version is {qrcode.version}, "
+                  f"font_size is {font_label.size if font_label else '0: No identifier'}, "
+                  f"scale is {layout['scale']}")
+
+    canvas_size = layout["canvas"]
+    # the panel shows the canvas turned clockwise, in portrait orientation as it is. The square layout with scale
+    # bar draws the labels before it turns the canvas by 90 degrees and back, so they keep their orientation.
+    rotation = None if orientation == "P" else "cw"
+    label_rotation = None if orientation == "S" and layout["scale_bar"] else rotation
+    frame = compositor.new_frame(*panel_size())
+
+    def draw_scale_bar():
+        if layout["scale_bar"]:
+            bitmap, x, y = scale_bar_bitmap(canvas_size, layout["scale_bar"], rotation)
+            compositor.place(frame, bitmap, x, y, canvas_size, rotation)
+
+    # the same order as the PIL layouts, later parts cover earlier ones
+    if orientation != "S":
+        draw_scale_bar()
+    if font_label:
+        x, y = layout["label_origin"]
+        for c, label in enumerate(labels):
+            compositor.draw_text(frame, x, y + c * font_label.size, label.strip('\n\r'), font_label, canvas_size,
+                                 label_rotation)
+    if orientation == "S":
+        draw_scale_bar()
+    compositor.place(frame, compositor.module_bitmap(qrcode.matrix, layout["scale"], rotation),
+                     *layout["qr_origin"], canvas_size, rotation)
+    return compositor.to_bytes(frame)
+
+
+def tile_grid(count, orientation):
+    """
+    :returns: columns and rows of a tiled screen: a 2x2 grid on a square display, one row in landscape and
+              one column in portrait orientation
+    """
+    if orientation == "S":
+        columns = 1 if count == 1 else 2
+        return columns, math.ceil(count / columns)
+    if orientation == "L":
+        return count, 1
+    return 1, count
+
+
+def show_tiled(tiles, font_size, scale_type, display_type):
+    """
+    renders several codes with their labels on one screen.
+    :param tiles: list of dicts with data and labels
+    """
+    if not tiles or len(tiles) > max_tiles:
+        raise Exception(f"A tiled screen takes 1 to {max_tiles} codes.")
+
+    if display_specs[connected_display_type]["layout"] == "square":
+        orientation = "S"
+        canvas_size = display_dimensions_pixels
+    elif display_type[-1:] == "P":
+        orientation = "P"
+        canvas_size = (display_dimensions_pixels[1], display_dimensions_pixels[0])
+    else:
+        orientation = "L"
+        canvas_size = display_dimensions_pixels
+
+    img_out = Image.new('1', canvas_size, 255)  # 255: clear the frame
+    try:
+        canvas = ImageDraw.Draw(img_out)
+
+        # the area left for the tiles: there is no room for the scale bar on a square display
+        left, top, right, bottom = margin, margin, canvas_size[0] - margin, canvas_size[1] - margin
+        if scale_type.lower() != "none" and orientation != "S":
+            if orientation == "L":
+                y = canvas_size[1] - margin - one_cm_smaller / 2
+                draw_scale(canvas, margin, y, one_cm_wider / 2, width_cm=6)
+                bottom = int(y) - margin
+            else:
+                draw_scale(canvas, margin, margin, one_cm_wider / 2)
+                top = int(2 * margin + one_cm_wider / 2)
+
+        columns, rows = tile_grid(len(tiles), orientation)
+        cell_width = (right - left) // columns
+        cell_height = (bottom - top) // rows
+        min_scale = math.ceil(min_module_mm * one_mm_wider)
+        line_height = fit_font_sizes[0] + 2
+
+        for n, tile in enumerate(tiles):
+            x = left + (n % columns) * cell_width
+            y = top + (n // columns) * cell_height
+            labels = tile.get("labels") or []
+
+            qrcode = qrencoding.encode(tile["data"])
+            modules = qrcode.symbol_size(border=tile_border)[0]
+            scale = int(min(cell_width, cell_height - line_height * len(labels)) // modules)
+            if scale < min_scale:
+                raise Exception(f"{tile['data']} is too long to stay scannable on a screen with {len(tiles)} codes.")
+
+            out = io.BytesIO()
+            qrcode.save(out, scale=scale, border=tile_border, kind='png')
+            out.seek(0)
+            with Image.open(out) as img_qr_code:
+                img_out.paste(img_qr_code, (x, y))
+                qr_px = img_qr_code.height
+
+            # the labels start where the code does, after its quiet zone
+            label_area = (cell_width - tile_border * scale, cell_height - qr_px)
+            if font_size in ["auto", "fit"]:
+                font_label = fit_font(labels, label_area) if labels else None
+            else:
+                font_label = get_font(font_size, 0)
+            if font_label:
+                draw_label(canvas, labels, x + tile_border * scale, y + qr_px, font_label)
+
+        if orientation == "S":
+            return img_out.rotate(270)
+        elif orientation == "P":
+            return img_out.rotate(0)
+        return img_out.rotate(180)
+    finally:
+        img_out.close()
+
+
+def render_frame(data, labels, display_type, font_size, scale_type, tiles=None):
+    """
+    renders a QR code layout.
+    :param tiles: list of dicts with data and labels to put several codes on one screen instead of data and labels
+    :returns: the packed panel frame as bytes
+    """
+    if not display_type.startswith(connected_display_type):
+        raise Exception(f"requested display type {display_type} different from connected {connected_display_type}.")
+
+    img = None
+    layout = display_specs[connected_display_type]["layout"]
+    if not tiles and composable(labels or []):
+        return compose_code(data, font_size, labels or [], scale_type, display_type)
+
+    if tiles:
+        img = show_tiled(tiles, font_size, scale_type, display_type)
+    elif layout == "square":
+        img = show_on_square_display(data, font_size, labels, scale_type)
+    elif layout == "wide":
+        img = show_on_2_9_display(data, font_size, labels, scale_type, display_type)
+
+    if not img:
+        raise Exception('No image to show.')
+
+    try:
+        return pack_frame(img)
+    finally:
+        img.close()
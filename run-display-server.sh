@@ -2,6 +2,8 @@
 echo Waiting 10 seconds ...
 sleep 60
 cd /home/pi/code/einkdisplay
+# the display daemon owns the panel, flask forwards the jobs to it
+export EINK_DAEMON_SOCKET=/tmp/einkdisplay.sock
+python display_daemon.py $EINK_DAEMON_SOCKET > daemon.log 2>&1 &
 flask run > log.log &
 
-
@@ -0,0 +1,219 @@
+"""
+SPI throughput calibration of the connected panel.
+
+Stop the server first, the calibration needs the panel for itself:
+
+    python spicalibration.py --verify display
+
+A test frame is uploaded at every clock rate (--rates, MHz) and chunk size (--chunks, bytes per SPI transfer). The
+effective throughput and the overhead per transfer are measured and every clock rate is verified:
+
+    ram       the RAM the simulated backend (EINK_SIMULATED_PANEL=1) reconstructs from the transfers must match
+    display   a QR code with the clock rate and a checksum is shown; scan it and confirm that it reads as expected
+    none      no check
+
+The fastest verified settings are saved to the panel's SPI profile (EINK_SPI_PROFILE, default spi-<panel>.json)
+that the server loads at startup.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+
+default_rates = [2, 4, 8, 10, 16, 20]
+default_chunks = [256, 1024, 4096]
+
+
+def profile_file(panel):
+    return os.environ.get("EINK_SPI_PROFILE", "spi-{panel}.json").format(panel=panel)
+
+
+def load_profile(file_name):
+    """
+    :returns: the saved profile or None
+    """
+    if not file_name or not os.path.exists(file_name):
+        return None
+    try:
+        with open(file_name) as f:
+            profile = json.load(f)
+        int(profile["spi_hz"]), int(profile["chunk_size"])
+        return profile
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.error(f"spicalibration.load_profile: {file_name} ignored: {repr(e)}")
+        return None
+
+
+def save_profile(file_name, profile):
+    tmp = file_name + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp, file_name)
+
+
+class TransferCounter:
+    """
+    counts the SPI transfers and bytes of the driver calls in its with block.
+    """
+
+    def __init__(self, epdconfig):
+        self.epdconfig = epdconfig
+        self.transfers = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        self._writebyte = self.epdconfig.spi_writebyte
+        self._writebyte2 = self.epdconfig.spi_writebyte2
+        chunk_size = self.epdconfig.spi_settings()["chunk_size"]
+
+        def counted(write):
+            def wrapper(data):
+                self.transfers += max(1, math.ceil(len(data) / chunk_size))
+                self.bytes += len(data)
+                write(data)
+            return wrapper
+
+        self.epdconfig.spi_writebyte = counted(self._writebyte)
+        self.epdconfig.spi_writebyte2 = counted(self._writebyte2)
+        return self
+
+    def __exit__(self, *exc):
+        self.epdconfig.spi_writebyte = self._writebyte
+        self.epdconfig.spi_writebyte2 = self._writebyte2
+
+
+def measure(epd, epdconfig, frame, repeats):
+    """
+    uploads the whole frame repeats times.
+    :returns: the fastest upload in seconds and the transfers and bytes of one upload
+    """
+    best = None
+    for n in range(repeats):
+        epd.shadow.invalidate()
+        if n == 0:
+            with TransferCounter(epdconfig) as counter:
+                start = time.perf_counter()
+                epd.upload(frame)
+                seconds = time.perf_counter() - start
+        else:
+            start = time.perf_counter()
+            epd.upload(frame)
+            seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, counter.transfers, counter.bytes
+
+
+def verify_ram(epd, epdconfig, frame):
+    return epdconfig.read_ram(int(epd.width / 8), epd.height) == bytes(frame)
+
+
+def verify_display(epd, spi_hz, rendering):
+    checksum = f"{spi_hz} {random.getrandbits(32):08x}"
+    frame = rendering.render_frame(f"SPI {checksum}", [f"{spi_hz / 1000000:g} MHz", checksum],
+                                   rendering.connected_display_type, "auto", "none")
+    epd.shadow.invalidate()
+    epd.display(frame)
+    answer = input(f"does the code on the panel read 'SPI {checksum}'? [y/n] ")
+    return answer.strip().lower().startswith("y")
+
+
+def calibrate(epd, epdconfig, rates, chunks, verify, repeats=3, rendering=None):
+    """
+    :returns: a result per clock rate and chunk size: spi_hz, chunk_size, bytes_per_s, overhead_us and verified
+    """
+    frame = bytes(random.Random(1).getrandbits(8) for _ in range(epd.frame_size))
+    results = []
+    for spi_hz in rates:
+        verified = None
+        for chunk_size in chunks:
+            epdconfig.set_spi(spi_hz, chunk_size)
+            seconds, transfers, sent = measure(epd, epdconfig, frame, repeats)
+            if verify == "ram":
+                ok = verify_ram(epd, epdconfig, frame)
+            elif verify == "display":
+                # the clock rate decides whether the data arrives, the chunk size does not: one check per rate
+                if verified is None:
+                    verified = verify_display(epd, spi_hz, rendering)
+                ok = verified
+            else:
+                ok = True
+            wire_seconds = sent * 8 / spi_hz
+            results.append({"spi_hz": spi_hz,
+                            "chunk_size": chunk_size,
+                            "bytes_per_s": round(sent / seconds),
+                            "overhead_us": round(max(0.0, seconds - wire_seconds) * 1000000 / transfers, 1),
+                            "verified": ok})
+            print(f"{spi_hz / 1000000:5g} MHz {chunk_size:5d} B chunks: {results[-1]['bytes_per_s']:8d} B/s, "
+                  f"{results[-1]['overhead_us']:7.1f} us per transfer, {'ok' if ok else 'FAILED'}", file=sys.stderr)
+    return results
+
+
+def best_settings(results):
+    """
+    the fastest settings at a clock rate that passed, like all slower rates did, so that one lucky pass at the
+    edge of what the wiring allows is not used.
+    :returns: the result or None
+    """
+    safe = []
+    for spi_hz in sorted({r["spi_hz"] for r in results}):
+        at_rate = [r for r in results if r["spi_hz"] == spi_hz]
+        if not all(r["verified"] for r in at_rate):
+            break
+        safe.extend(at_rate)
+    return max(safe, key=lambda r: r["bytes_per_s"]) if safe else None
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SPI throughput calibration of the connected panel")
+    parser.add_argument("--verify", choices=["ram", "display", "none"], default="display")
+    parser.add_argument("--rates", default=",".join(str(r) for r in default_rates), help="clock rates in MHz")
+    parser.add_argument("--chunks", default=",".join(str(c) for c in default_chunks),
+                        help="bytes per SPI transfer")
+    parser.add_argument("--repeats", type=positive_int, default=3, help="uploads per setting, the fastest one counts")
+    parser.add_argument("--dry-run", action="store_true", help="do not save the profile")
+    args = parser.parse_args()
+
+    import display_core as core
+    import rendering
+    from waveshare import epdconfig
+
+    if not core.RaspPI:
+        sys.exit("the calibration needs the panel driver")
+    epd = core.display.EPD()
+    if args.verify == "ram" and (not hasattr(epdconfig, "read_ram") or epd.colour_planes != 1):
+        sys.exit("RAM verification needs the simulated backend and a black/white panel, use --verify display")
+    if epd.init() != 0:
+        sys.exit("panel init failed")
+
+    rates = [int(float(rate) * 1000000) for rate in args.rates.split(",")]
+    chunks = [int(chunk) for chunk in args.chunks.split(",")]
+    try:
+        results = calibrate(epd, epdconfig, rates, chunks, args.verify, args.repeats, rendering)
+    finally:
+        epd.sleep()
+
+    best = best_settings(results)
+    if not best:
+        sys.exit("no setting passed the verification")
+    profile = dict(best, panel=core.connected_display_type, verify=args.verify, calibrated=time.time(),
+                   results=results)
+    print(json.dumps({k: v for k, v in profile.items() if k != "results"}, indent=2))
+    if not args.dry_run:
+        file_name = profile_file(core.connected_display_type)
+        save_profile(file_name, profile)
+        print(f"saved to {file_name}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import pytest
+
+import rendering
+
+
+def overlaps(a, b):
+    # a, b: (x, y, width, height)
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def label_rect(layout):
+    x, y = layout["label_origin"]
+    width, height = layout["label_area"]
+    if layout["orientation"] == "S" and layout["scale_bar"]:
+        # the labels are drawn before the canvas is turned by 90 degrees counter-clockwise
+        side = layout["canvas"][0]
+        return y, side - x - width, height, width
+    return x, y, width, height
+
+
+def scale_bar_rect(layout):
+    x, y, height, width_cm = layout["scale_bar"]
+    return x, y, width_cm * rendering.one_cm_wider, height
+
+
+@pytest.mark.parametrize("display_type", list(rendering.display_specs))
+def test_scale_is_the_largest_that_fits(display_type):
+    rendering.configure(display_type)
+    for (orientation, version, with_scale), layout in rendering.layouts.items():
+        modules = 4 * version + 17
+        assert layout["qr_px"] == modules * layout["scale"]
+        assert layout["qr_px"] <= layout["qr_extent"] < modules * (layout["scale"] + 1), (orientation, version)
+
+        if not layout["fits"]:
+            continue
+        x, y = layout["qr_origin"]
+        qr = (x, y, layout["qr_px"], layout["qr_px"])
+        canvas = layout["canvas"]
+        assert x + layout["qr_px"] <= canvas[0] and y + layout["qr_px"] <= canvas[1], (orientation, version)
+        assert not overlaps(qr, label_rect(layout)), (orientation, version, with_scale)
+        assert layout["label_area"][1] >= rendering.label_lines * layout["default_font_size"] or \
+            layout["label_area"][0] >= rendering.label_lines * layout["default_font_size"]
+        if with_scale:
+            assert not overlaps(qr, scale_bar_rect(layout)), (orientation, version)
+
+
+def test_versions_above_a_round_threshold_keep_their_scale():
+    rendering.configure("1.54")
+    assert rendering.layouts[("S", 9, False)]["scale"] == 2
+    assert rendering.layouts[("S", 10, False)]["scale"] == 2
+    rendering.configure("2.9")
+    assert rendering.layouts[("L", 5, False)]["scale"] == 3
+
+
+@pytest.mark.parametrize("display_type,orientation", [("1.54", "S"), ("2.9", "L"), ("2.9P", "P")])
+@pytest.mark.parametrize("use_compositor", [True, False])
+def test_too_large_version_fails_instead_of_drawing_a_blank_frame(display_type, orientation, use_compositor,
+                                                                  monkeypatch):
+    rendering.configure(display_type.rstrip("P"))
+    monkeypatch.setattr(rendering, "use_compositor", use_compositor)
+    data = "1" * 5000
+    assert not rendering.layouts[(orientation, rendering.qrencoding.encode(data).version, False)]["fits"]
+    with pytest.raises(ValueError, match="too large"):
+        rendering.render_frame(data, ["label"], display_type, "auto", "none")
@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the panel startup of display_core.show_boot_screen, without the fonts
+startup = """
+import importlib, sys
+display = importlib.import_module("waveshare." + sys.argv[1])
+epd = display.EPD()
+assert epd.init(epd.lut_full_update) == 0
+epd.Clear(0xFF)
+epd.display(bytes(epd.frame_size))
+epd.sleep()
+"""
+
+
+@pytest.mark.parametrize("driver", ["epd1in54", "epd1in54b", "epd2in9"])
+def test_panel_starts_on_the_simulated_backend(driver):
+    env = dict(os.environ, EINK_SIMULATED_PANEL="1", EINK_SIM_REFRESH_MS="10")
+    subprocess.run([sys.executable, "-c", startup, driver], cwd=repo, env=env, check=True, timeout=30)
@@ -29,6 +29,8 @@
 
 import logging
 from . import epdconfig
+from .epdbase import EPDBase
+from .packing import double_bits
 
 # Display resolution
 EPD_WIDTH       = 200
@@ -36,14 +38,15 @@ EPD_HEIGHT      = 200
 
 logger = logging.getLogger(__name__)
 
-class EPD:
-    def __init__(self):
-        self.reset_pin = epdconfig.RST_PIN
-        self.dc_pin = epdconfig.DC_PIN
-        self.busy_pin = epdconfig.BUSY_PIN
-        self.cs_pin = epdconfig.CS_PIN
-        self.width = EPD_WIDTH
-        self.height = EPD_HEIGHT
+class EPD(EPDBase):
+    name = "1.54b"
+    width = EPD_WIDTH
+    height = EPD_HEIGHT
+    colour_planes = 2
+    # busy pin is low while the panel is busy
+    busy_level = 0
+    refresh_command = 0x12  # DISPLAY_REFRESH
+    refresh_ms = {"full": 15000}
 
     lut_vcom0 = [0x0E, 0x14, 0x01, 0x0A, 0x06, 0x04, 0x0A, 0x0A, 0x0F, 0x03, 0x03, 0x0C, 0x06, 0x0A, 0x00]
     lut_w = [0x0E, 0x14, 0x01, 0x0A, 0x46, 0x04, 0x8A, 0x4A, 0x0F, 0x83, 0x43, 0x0C, 0x86, 0x0A, 0x04]
@@ -53,63 +56,29 @@ class EPD:
     lut_vcom1 = [0x03, 0x1D, 0x01, 0x01, 0x08, 0x23, 0x37, 0x37, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
     lut_red0 = [0x83, 0x5D, 0x01, 0x81, 0x48, 0x23, 0x77, 0x77, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
     lut_red1 = [0x03, 0x1D, 0x01, 0x01, 0x08, 0x23, 0x37, 0x37, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00] 
-    
-    # Hardware reset
-    def reset(self):
-        epdconfig.digital_write(self.reset_pin, 1)
-        epdconfig.delay_ms(200) 
-        epdconfig.digital_write(self.reset_pin, 0) # module reset
-        epdconfig.delay_ms(5)
-        epdconfig.digital_write(self.reset_pin, 1)
-        epdconfig.delay_ms(200)   
 
-    def send_command(self, command):
-        epdconfig.digital_write(self.dc_pin, 0)
-        epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.spi_writebyte([command])
-        epdconfig.digital_write(self.cs_pin, 1)
-
-    def send_data(self, data):
-        epdconfig.digital_write(self.dc_pin, 1)
-        epdconfig.digital_write(self.cs_pin, 0)
-        epdconfig.spi_writebyte([data])
-        epdconfig.digital_write(self.cs_pin, 1)
-        
-    def ReadBusy(self):
-        logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 0):
-            epdconfig.delay_ms(100)    
-        logger.debug("e-Paper busy release")
-      
     def set_lut_bw(self):
         self.send_command(0x20) # vcom
-        for count in range(0, 15):
-            self.send_data(self.lut_vcom0[count])
+        self.send_data2(self.lut_vcom0)
         self.send_command(0x21) # ww --
-        for count in range(0, 15):
-            self.send_data(self.lut_w[count])
+        self.send_data2(self.lut_w)
         self.send_command(0x22) # bw r
-        for count in range(0, 15):
-            self.send_data(self.lut_b[count])
+        self.send_data2(self.lut_b)
         self.send_command(0x23) # wb w
-        for count in range(0, 15):
-            self.send_data(self.lut_g1[count])
+        self.send_data2(self.lut_g1)
         self.send_command(0x24) # bb b
-        for count in range(0, 15):
-            self.send_data(self.lut_g2[count])
+        self.send_data2(self.lut_g2)
 
     def set_lut_red(self):
         self.send_command(0x25)
-        for count in range(0, 15):
-            self.send_data(self.lut_vcom1[count])
+        self.send_data2(self.lut_vcom1)
         self.send_command(0x26)
-        for count in range(0, 15):
-            self.send_data(self.lut_red0[count])
+        self.send_data2(self.lut_red0)
         self.send_command(0x27)
-        for count in range(0, 15):
-            self.send_data(self.lut_red1[count])
+        self.send_data2(self.lut_red1)
             
-    def init(self):
+    def init(self, lut=None):
+        # the waveform of this panel is fixed, lut is accepted for the common panel interface
         if (epdconfig.module_init() != 0):
             return -1
         # EPD hardware init start
@@ -145,61 +114,30 @@ class EPD:
         self.set_lut_red()
         return 0
 
-    def getbuffer(self, image):
-        buf = [0xFF] * int(self.width * self.height / 8)
-        # Set buffer to value of Python Imaging Library image.
-        # Image must be in mode 1.
-        image_monocolor = image.convert('1')
-        imwidth, imheight = image_monocolor.size
-        if imwidth != self.width or imheight != self.height:
-            raise ValueError('Image must be same dimensions as display \
-                ({0}x{1}).' .format(self.width, self.height))
-
-        pixels = image_monocolor.load()
-        for y in range(self.height):
-            for x in range(self.width):
-                # Set the bits for the column of pixels at the current position.
-                if pixels[x, y] == 0:
-                    buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
-        return buf
-
-    def display(self, blackimage, redimage):
-        # send black data
-        if (blackimage != None):
-            self.send_command(0x10) # DATA_START_TRANSMISSION_1
-            for i in range(0, int(self.width * self.height / 8)):
-                temp = 0x00
-                for bit in range(0, 4):
-                    if (blackimage[i] & (0x80 >> bit) != 0):
-                        temp |= 0xC0 >> (bit * 2)
-                self.send_data(temp)  
-                temp = 0x00
-                for bit in range(4, 8):
-                    if (blackimage[i] & (0x80 >> bit) != 0):
-                        temp |= 0xC0 >> ((bit - 4) * 2)
-                self.send_data(temp)
-                
-        # send red data        
-        if (redimage != None):
-            self.send_command(0x13) # DATA_START_TRANSMISSION_2
-            for i in range(0, int(self.width * self.height / 8)):
-                self.send_data(redimage[i])  
-
-        self.send_command(0x12) # DISPLAY_REFRESH
-        self.ReadBusy()
-
-    def Clear(self):
+    def upload(self, blackimage, redimage=None):
+        # write both planes to the controller RAM without refreshing the panel.
+        # The black plane takes 2 bits per pixel. Without a red plane nothing is red.
+        black = double_bits(blackimage[0:self.frame_size])
         self.send_command(0x10) # DATA_START_TRANSMISSION_1
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)
-            self.send_data(0xFF)
-            
+        self.send_data2(black)
+
+        red = b"\xff" * self.frame_size if redimage is None else redimage[0:self.frame_size]
         self.send_command(0x13) # DATA_START_TRANSMISSION_2
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)
+        self.send_data2(red)
+        self.shadow.store(blackimage)
+        # both planes are always sent whole, so nothing is skipped
+        self.shadow.record_upload(len(black) + len(red), len(black) + len(red))
 
+    def TurnOnDisplay(self):
         self.send_command(0x12) # DISPLAY_REFRESH
         self.ReadBusy()
+        self.shadow.toggle()
+
+    def display(self, blackimage, redimage=None):
+        if (blackimage == None):
+            return
+        self.upload(blackimage, redimage)
+        self.TurnOnDisplay()
 
     def sleep(self):
         self.send_command(0x50) # VCOM_AND_DATA_INTERVAL_SETTING
@@ -217,6 +155,6 @@ class EPD:
         
         epdconfig.delay_ms(2000)
         epdconfig.module_exit()
+        self.shadow.invalidate()
 
 ### END OF FILE ###
-
@@ -0,0 +1,261 @@
+import logging
+from . import epdconfig
+from .packing import pack_image
+from .ramshadow import RamShadow
+
+logger = logging.getLogger(__name__)
+
+# The panel interface shared by all drivers. The server only uses what is defined here and looks at
+# EPD.capabilities for everything that differs between panels:
+#
+#   name                 the display type the panel is configured with, e.g. "1.54"
+#   width, height        size of the panel RAM in pixels, width is the direction of the bits in a byte
+#   native_orientation   "square", "portrait" (width < height) or "landscape"
+#   colour_planes        1 for black/white, 2 for black/white/red
+#   partial_refresh      True if the panel has a partial update LUT (lut_partial_update)
+#   ram                  RAM layout: bits_per_pixel, line_width in bytes, areas (memory areas that toggle on refresh)
+#   refresh_ms           typical duration of a "full" and, if supported, a "partial" refresh
+#
+# Methods: init(lut=None), SetLut(lut), getbuffer(image), upload(image), TurnOnDisplay(), display(image),
+# Clear(color=0xFF), sleep()
+
+
+def probe_busy_idle_level():
+    """
+    resets the panel and reads the busy pin. The pin cannot tell the panel size, but it is low on the
+    black/white SSD16xx controllers and high on the black/white/red ones once the reset is done.
+    :returns: the level of the busy pin
+    """
+    if epdconfig.module_init() != 0:
+        return None
+    epdconfig.digital_write(epdconfig.RST_PIN, 1)
+    epdconfig.delay_ms(200)
+    epdconfig.digital_write(epdconfig.RST_PIN, 0)
+    epdconfig.delay_ms(5)
+    epdconfig.digital_write(epdconfig.RST_PIN, 1)
+    epdconfig.delay_ms(200)
+    level = epdconfig.digital_read(epdconfig.BUSY_PIN)
+    epdconfig.module_exit()
+    return level
+
+
+class EPDBase:
+    name = ""
+    width = 0
+    height = 0
+    colour_planes = 1
+    ram_areas = 1
+    # level of the busy pin while the panel is busy and the poll interval
+    busy_level = 1
+    busy_poll_ms = 100
+    # the command TurnOnDisplay starts the refresh with, MASTER_ACTIVATION on the SSD16xx controllers
+    refresh_command = 0x20
+    refresh_ms = {"full": 2000}
+    lut_full_update = None
+
+    def __init__(self):
+        self.reset_pin = epdconfig.RST_PIN
+        self.dc_pin = epdconfig.DC_PIN
+        self.busy_pin = epdconfig.BUSY_PIN
+        self.cs_pin = epdconfig.CS_PIN
+        self.shadow = RamShadow(int(self.width / 8), self.height, areas=self.ram_areas)
+        if hasattr(epdconfig, "simulate"):
+            epdconfig.simulate(self.busy_level, self.refresh_command)
+
+    @property
+    def capabilities(self):
+        if self.width == self.height:
+            orientation = "square"
+        else:
+            orientation = "portrait" if self.width < self.height else "landscape"
+        return {"name": self.name,
+                "width": self.width,
+                "height": self.height,
+                "native_orientation": orientation,
+                "colour_planes": self.colour_planes,
+                "partial_refresh": getattr(self, "lut_partial_update", None) is not None,
+                "ram": {"bits_per_pixel": 1, "line_width": int(self.width / 8), "areas": self.ram_areas},
+                "refresh_ms": dict(self.refresh_ms)}
+
+    @property
+    def frame_size(self):
+        return int(self.width / 8) * self.height
+
+    # Hardware reset
+    def reset(self):
+        self.shadow.invalidate()
+        epdconfig.digital_write(self.reset_pin, 1)
+        epdconfig.delay_ms(200)
+        epdconfig.digital_write(self.reset_pin, 0)         # module reset
+        epdconfig.delay_ms(5)
+        epdconfig.digital_write(self.reset_pin, 1)
+        epdconfig.delay_ms(200)
+
+    def send_command(self, command):
+        epdconfig.digital_write(self.dc_pin, 0)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte([command])
+        epdconfig.digital_write(self.cs_pin, 1)
+
+    def send_data(self, data):
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte([data])
+        epdconfig.digital_write(self.cs_pin, 1)
+
+    # send a whole block of data bytes in one SPI transfer
+    def send_data2(self, data):
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte2(data)
+        epdconfig.digital_write(self.cs_pin, 1)
+
+    def ReadBusy(self):
+        logger.debug("e-Paper busy")
+        while(epdconfig.digital_read(self.busy_pin) == self.busy_level):
+            epdconfig.delay_ms(self.busy_poll_ms)
+        logger.debug("e-Paper busy release")
+
+    def SetLut(self, lut):
+        # panels without a LUT register keep their OTP waveform
+        pass
+
+    def getbuffer(self, image):
+        return pack_image(image, self.width, self.height)
+
+    def display(self, image):
+        if (image == None):
+            return
+
+        self.upload(image)
+        self.TurnOnDisplay()
+
+    def Clear(self, color=0xFF):
+        self.upload(bytes([color]) * self.frame_size)
+        self.TurnOnDisplay()
+
+
+class SSD16xx(EPDBase):
+    """
+    the controller of the black/white 1.54" and 2.9" panels: one RAM window written with WRITE_RAM,
+    waveform from a LUT in the register, two memory areas that toggle on every refresh.
+    """
+    ram_areas = 2
+    refresh_ms = {"full": 2000, "partial": 300}
+    # the original 1.54" driver sets a window one byte wider than a row and the cursor for every row
+    full_window_per_row = False
+    # wait for the busy pin after setting the RAM cursor
+    busy_after_cursor = False
+
+    def TurnOnDisplay(self):
+        self.send_command(0x22) # DISPLAY_UPDATE_CONTROL_2
+        self.send_data(0xC4)
+        self.send_command(0x20) # MASTER_ACTIVATION
+        self.send_command(0xFF) # TERMINATE_FRAME_READ_WRITE
+
+        self.ReadBusy()
+        self.shadow.toggle()
+
+    def SetWindow(self, x_start, y_start, x_end, y_end):
+        self.send_command(0x44) # SET_RAM_X_ADDRESS_START_END_POSITION
+        # x point must be the multiple of 8 or the last 3 bits will be ignored
+        self.send_data((x_start >> 3) & 0xFF)
+        self.send_data((x_end >> 3) & 0xFF)
+        self.send_command(0x45) # SET_RAM_Y_ADDRESS_START_END_POSITION
+        self.send_data(y_start & 0xFF)
+        self.send_data((y_start >> 8) & 0xFF)
+        self.send_data(y_end & 0xFF)
+        self.send_data((y_end >> 8) & 0xFF)
+
+    def SetCursor(self, x, y):
+        self.send_command(0x4E) # SET_RAM_X_ADDRESS_COUNTER
+        # x point must be the multiple of 8 or the last 3 bits will be ignored
+        self.send_data((x >> 3) & 0xFF)
+        self.send_command(0x4F) # SET_RAM_Y_ADDRESS_COUNTER
+        self.send_data(y & 0xFF)
+        self.send_data((y >> 8) & 0xFF)
+        if self.busy_after_cursor:
+            self.ReadBusy()
+
+    def SetLut(self, lut):
+        self.send_command(0x32) # WRITE_LUT_REGISTER
+        self.send_data2(lut)
+
+    def init(self, lut=None):
+        if (epdconfig.module_init() != 0):
+            return -1
+        # EPD hardware init start
+        self.reset()
+
+        self.send_command(0x01) # DRIVER_OUTPUT_CONTROL
+        self.send_data((self.height - 1) & 0xFF)
+        self.send_data(((self.height - 1) >> 8) & 0xFF)
+        self.send_data(0x00) # GD = 0 SM = 0 TB = 0
+
+        self.send_command(0x0C) # BOOSTER_SOFT_START_CONTROL
+        self.send_data(0xD7)
+        self.send_data(0xD6)
+        self.send_data(0x9D)
+
+        self.send_command(0x2C) # WRITE_VCOM_REGISTER
+        self.send_data(0xA8) # VCOM 7C
+
+        self.send_command(0x3A) # SET_DUMMY_LINE_PERIOD
+        self.send_data(0x1A) # 4 dummy lines per gate
+
+        self.send_command(0x3B) # SET_GATE_TIME
+        self.send_data(0x08) # 2us per line
+
+        self.send_command(0x11) # DATA_ENTRY_MODE_SETTING
+        self.send_data(0x03) # X increment Y increment
+
+        # set the look-up table register
+        self.SetLut(lut if lut is not None else self.lut_full_update)
+        # EPD hardware init end
+        return 0
+
+    def upload(self, image):
+        # write the frame to the controller RAM without refreshing the panel.
+        # Only rows that differ from the RAM are sent, unless the RAM content is unknown.
+        spans = self.shadow.changed_spans(image)
+        if spans is None:
+            line_width = int(self.width / 8)
+            if self.full_window_per_row:
+                self.SetWindow(0, 0, self.width, self.height)
+                for j in range(0, self.height):
+                    self.SetCursor(0, j)
+                    self.send_command(0x24) # WRITE_RAM
+                    self.send_data2(image[j * line_width:(j + 1) * line_width])
+            else:
+                # The window matches the frame exactly, so the RAM address wraps to the next row by itself.
+                self.SetWindow(0, 0, self.width - 1, self.height - 1)
+                self.SetCursor(0, 0)
+                self.send_command(0x24) # WRITE_RAM
+                self.send_data2(image[0:line_width * self.height])
+            sent = self.shadow.store(image)
+        else:
+            sent = 0
+            for span in spans:
+                sent += self.upload_region(image, *span)
+        self.shadow.record_upload(sent)
+
+    def upload_region(self, image, x_start, y_start, x_end, y_end):
+        # write a window of a full frame buffer to the controller RAM without refreshing the panel.
+        # Coordinates are inclusive, x_start and x_end must be multiples of 8. Returns the bytes sent.
+        line_width = int(self.width / 8)
+        data = []
+        for j in range(y_start, y_end + 1):
+            data.extend(image[j * line_width + (x_start >> 3):j * line_width + (x_end >> 3) + 1])
+        self.SetWindow(x_start, y_start, x_end, y_end)
+        self.SetCursor(x_start, y_start)
+        self.send_command(0x24) # WRITE_RAM
+        self.send_data2(data)
+        return self.shadow.store(image, x_start, y_start, x_end, y_end)
+
+    def sleep(self):
+        self.send_command(0x10) # DEEP_SLEEP_MODE
+        self.send_data(0x01)
+
+        epdconfig.delay_ms(2000)
+        epdconfig.module_exit()
+        self.shadow.invalidate()
@@ -29,6 +29,7 @@
 
 import os
 import logging
+import random
 import sys
 import time
 
@@ -48,6 +49,10 @@ class RaspberryPi:
 
         self.GPIO = RPi.GPIO
         self.SPI = spidev.SpiDev()
+        # SPI clock and the largest block written with one transfer, see spicalibration.py
+        self.spi_hz = 4000000
+        self.chunk_size = 4096
+        self._open = False
 
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
@@ -62,7 +67,26 @@ class RaspberryPi:
         self.SPI.writebytes(data)
 
     def spi_writebyte2(self, data):
-        self.SPI.writebytes2(data)
+        for start in range(0, len(data), self.chunk_size):
+            self.SPI.writebytes2(data[start:start + self.chunk_size])
+
+    def simulate(self, busy_level, refresh_command):
+        """
+        behaves like the controller of the driver's panel.
+        :param busy_level: level of the busy pin while the panel is busy
+        :param refresh_command: the command that starts a refresh
+        """
+        self._busy_level = busy_level
+        self._refresh_command = refresh_command
+
+    def set_spi(self, spi_hz, chunk_size):
+        self.spi_hz = spi_hz
+        self.chunk_size = chunk_size
+        if self._open:
+            self.SPI.max_speed_hz = spi_hz
+
+    def spi_settings(self):
+        return {"spi_hz": self.spi_hz, "chunk_size": self.chunk_size}
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
@@ -74,13 +98,15 @@ class RaspberryPi:
 
         # SPI device, bus = 0, device = 0
         self.SPI.open(0, 0)
-        self.SPI.max_speed_hz = 4000000
+        self.SPI.max_speed_hz = self.spi_hz
         self.SPI.mode = 0b00
+        self._open = True
         return 0
 
     def module_exit(self):
         logger.debug("spi end")
         self.SPI.close()
+        self._open = False
 
         logger.debug("close 5V, Module enters 0 power consumption ...")
         self.GPIO.output(self.RST_PIN, 0)
@@ -112,8 +138,19 @@ class JetsonNano:
         if self.SPI is None:
             raise RuntimeError('Cannot find sysfs_software_spi.so')
 
+        # bulk entry point, see sysfs_software_spi_buffer.c. Older builds of the library don't have it.
+        try:
+            self._transfer_buffer = self.SPI.SYSFS_software_spi_transfer_buffer
+            self._transfer_buffer.argtypes = [ctypes.c_char_p, ctypes.c_uint32]
+            self._transfer_buffer.restype = None
+        except AttributeError:
+            logger.warning("sysfs_software_spi.so has no SYSFS_software_spi_transfer_buffer, "
+                           "falling back to one call per byte")
+            self._transfer_buffer = None
+
         import Jetson.GPIO
         self.GPIO = Jetson.GPIO
+        self.chunk_size = 4096
 
     def digital_write(self, pin, value):
         self.GPIO.output(pin, value)
@@ -127,6 +164,30 @@ class JetsonNano:
     def spi_writebyte(self, data):
         self.SPI.SYSFS_software_spi_transfer(data[0])
 
+    def spi_writebyte2(self, data):
+        data = bytes(data)
+        if self._transfer_buffer:
+            self._transfer_buffer(data, len(data))
+        else:
+            for value in data:
+                self.SPI.SYSFS_software_spi_transfer(value)
+
+    def simulate(self, busy_level, refresh_command):
+        """
+        behaves like the controller of the driver's panel.
+        :param busy_level: level of the busy pin while the panel is busy
+        :param refresh_command: the command that starts a refresh
+        """
+        self._busy_level = busy_level
+        self._refresh_command = refresh_command
+
+    def set_spi(self, spi_hz, chunk_size):
+        # the software SPI has no clock setting and writes the whole buffer in one call
+        self.chunk_size = chunk_size
+
+    def spi_settings(self):
+        return {"spi_hz": None, "chunk_size": self.chunk_size}
+
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
         self.GPIO.setwarnings(False)
@@ -148,7 +209,134 @@ class JetsonNano:
         self.GPIO.cleanup()
 
 
-if os.path.exists('/sys/bus/platform/drivers/gpiomem-bcm2835'):
+class Simulated:
+    """
+    panel backend without hardware for load tests (EINK_SIMULATED_PANEL=1). SPI transfers take the time they
+    would take at spi_hz plus a fixed overhead per transfer, and the panel is busy for refresh_ms after every
+    refresh command. The busy pin level and the refresh command are those of the driver (see simulate). Above EINK_SIM_SPI_MAX_HZ some data bytes arrive corrupted. The controller RAM written with
+    WRITE_RAM is kept (see read_ram), so that transfers can be checked.
+    """
+    # Pin definition
+    RST_PIN         = 17
+    DC_PIN          = 25
+    CS_PIN          = 8
+    BUSY_PIN        = 24
+
+    # size of the simulated RAM: bytes per row and rows
+    RAM_LINE_WIDTH  = 64
+    RAM_ROWS        = 512
+
+    def __init__(self):
+        self.spi_hz = int(os.environ.get("EINK_SIM_SPI_HZ", "4000000"))
+        self.refresh_ms = int(os.environ.get("EINK_SIM_REFRESH_MS", "1000"))
+        self.overhead_us = float(os.environ.get("EINK_SIM_SPI_OVERHEAD_US", "0"))
+        self.max_hz = int(os.environ.get("EINK_SIM_SPI_MAX_HZ", "0"))
+        self.chunk_size = 4096
+        self._dc = 0
+        self._busy_until = 0
+        # SSD16xx controllers until the driver tells otherwise: busy pin high while busy, MASTER_ACTIVATION
+        self._busy_level = 1
+        self._refresh_command = 0x20
+        self._command = None
+        self._params = []
+        self._window = (0, self.RAM_LINE_WIDTH - 1)
+        self._cursor = [0, 0]
+        self._ram = bytearray(self.RAM_LINE_WIDTH * self.RAM_ROWS)
+        self._random = random.Random(0)
+
+    def digital_write(self, pin, value):
+        if pin == self.DC_PIN:
+            self._dc = value
+
+    def digital_read(self, pin):
+        busy = time.monotonic() < self._busy_until
+        return self._busy_level if busy else 1 - self._busy_level
+
+    def delay_ms(self, delaytime):
+        time.sleep(delaytime / 1000.0)
+
+    def spi_writebyte(self, data):
+        self.spi_writebyte2(data)
+
+    def spi_writebyte2(self, data):
+        data = bytes(data)
+        for start in range(0, len(data), self.chunk_size):
+            chunk = data[start:start + self.chunk_size]
+            time.sleep(self.overhead_us / 1000000.0 + len(chunk) * 8 / self.spi_hz)
+            if self._dc == 0:
+                self._command = chunk[-1]
+                self._params = []
+                if self._command == self._refresh_command:
+                    self._busy_until = time.monotonic() + self.refresh_ms / 1000.0
+            else:
+                if self.max_hz and self.spi_hz > self.max_hz:
+                    chunk = self._corrupt(chunk)
+                self._receive(chunk)
+
+    def _corrupt(self, data):
+        data = bytearray(data)
+        for n in range(len(data)):
+            if self._random.random() < 0.01:
+                data[n] ^= 1 << self._random.randrange(8)
+        return bytes(data)
+
+    def _receive(self, data):
+        if self._command == 0x24:  # WRITE_RAM
+            x_start, x_end = self._window
+            x, y = self._cursor
+            for value in data:
+                if x < self.RAM_LINE_WIDTH and y < self.RAM_ROWS:
+                    self._ram[y * self.RAM_LINE_WIDTH + x] = value
+                x += 1
+                if x > x_end:
+                    x = x_start
+                    y += 1
+            self._cursor = [x, y]
+            return
+
+        self._params.extend(data)
+        p = self._params
+        if self._command == 0x44 and len(p) == 2:  # SET_RAM_X_ADDRESS_START_END_POSITION
+            self._window = (p[0], p[1])
+        elif self._command == 0x4E and len(p) == 1:  # SET_RAM_X_ADDRESS_COUNTER
+            self._cursor[0] = p[0]
+        elif self._command == 0x4F and len(p) == 2:  # SET_RAM_Y_ADDRESS_COUNTER
+            self._cursor[1] = p[0] | (p[1] << 8)
+
+    def read_ram(self, line_width, height):
+        """
+        :returns: the first height rows of line_width bytes of the RAM written with WRITE_RAM
+        """
+        return b"".join(bytes(self._ram[y * self.RAM_LINE_WIDTH:y * self.RAM_LINE_WIDTH + line_width])
+                        for y in range(height))
+
+    def simulate(self, busy_level, refresh_command):
+        """
+        behaves like the controller of the driver's panel.
+        :param busy_level: level of the busy pin while the panel is busy
+        :param refresh_command: the command that starts a refresh
+        """
+        self._busy_level = busy_level
+        self._refresh_command = refresh_command
+
+    def set_spi(self, spi_hz, chunk_size):
+        self.spi_hz = spi_hz
+        self.chunk_size = chunk_size
+
+    def spi_settings(self):
+        return {"spi_hz": self.spi_hz, "chunk_size": self.chunk_size}
+
+    def module_init(self):
+        logger.info(f"simulated panel: {self.spi_hz} Hz SPI, {self.refresh_ms} ms per refresh")
+        return 0
+
+    def module_exit(self):
+        logger.debug("simulated panel: spi end")
+
+
+if os.environ.get("EINK_SIMULATED_PANEL", "") not in ["", "0"]:
+    implementation = Simulated()
+elif os.path.exists('/sys/bus/platform/drivers/gpiomem-bcm2835'):
     implementation = RaspberryPi()
 else:
     implementation = JetsonNano()
@@ -0,0 +1,36 @@
+from PIL import Image
+
+# Packing of PIL images into the panel RAM layout, shared by all drivers and by the render workers.
+# It does not touch the hardware, so it can be imported without epdconfig.
+
+
+def pack_image(image, width, height):
+    """
+    packs an image into the panel RAM layout: one bit per pixel, rows of width pixels, most significant bit
+    first, 1 = white. An image of height x width pixels is turned into the panel's native orientation.
+    Gives the same result as the pixel loop of the original Waveshare getbuffer, but PIL does the packing.
+    :returns: the frame as bytes, all white if the image fits neither orientation
+    """
+    image_monocolor = image.convert('1')
+    if image_monocolor.size == (width, height):
+        return image_monocolor.tobytes()
+    elif image_monocolor.size == (height, width):
+        return image_monocolor.transpose(Image.ROTATE_90).tobytes()
+    return b"\xff" * (int(width / 8) * height)
+
+
+# every bit of a 1 bit per pixel plane doubled, for controllers that take 2 bits per pixel
+_doubled_bits = []
+for _value in range(256):
+    _doubled = 0
+    for _bit in range(8):
+        if _value & (0x80 >> _bit):
+            _doubled |= 0xC000 >> (_bit * 2)
+    _doubled_bits.append(_doubled.to_bytes(2, "big"))
+
+
+def double_bits(plane):
+    """
+    :returns: the plane with 2 bits per pixel, each pixel's bit repeated
+    """
+    return b"".join(_doubled_bits[value] for value in bytes(plane))
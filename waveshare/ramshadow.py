@@ -0,0 +1,111 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RamShadow:
+    """
+    keeps a copy of what has been written to the controller RAM of the SSD16xx style panels, so that an upload
+    only has to send the rows that differ. The controller has two memory areas that toggle on every refresh,
+    so there is one copy per memory area.
+    """
+
+    def __init__(self, line_width, height, areas=2, max_gap=2):
+        self.line_width = line_width
+        self.height = height
+        self.areas = [None] * areas
+        self.index = 0
+        # unchanged rows between two changed ones that are sent anyway to save the window setup
+        self.max_gap = max_gap
+        self.last_sent = 0
+        self.last_skipped = 0
+        self.bytes_sent = 0
+        self.bytes_skipped = 0
+        self.refreshes = 0
+
+    @property
+    def frame_size(self):
+        return self.line_width * self.height
+
+    def invalidate(self):
+        self.areas = [None] * len(self.areas)
+        self.index = 0
+
+    def toggle(self):
+        self.refreshes += 1
+        self.index = (self.index + 1) % len(self.areas)
+
+    def changed_spans(self, image):
+        """
+        :returns: list of windows (x_start, y_start, x_end, y_end) in pixels, inclusive and byte aligned,
+                  that cover all rows that differ from the RAM. None if the RAM content is unknown.
+        """
+        ram = self.areas[self.index]
+        if ram is None:
+            return None
+
+        lw = self.line_width
+        image = bytes(image)
+        rows = [j for j in range(self.height) if ram[j * lw:(j + 1) * lw] != image[j * lw:(j + 1) * lw]]
+
+        runs = []
+        for j in rows:
+            if runs and j - runs[-1][1] <= self.max_gap + 1:
+                runs[-1][1] = j
+            else:
+                runs.append([j, j])
+
+        spans = []
+        for y_start, y_end in runs:
+            first = lw
+            last = -1
+            for j in range(y_start, y_end + 1):
+                offset = j * lw
+                for i in range(0, first):
+                    if ram[offset + i] != image[offset + i]:
+                        first = i
+                        break
+                for i in range(lw - 1, last, -1):
+                    if ram[offset + i] != image[offset + i]:
+                        last = i
+                        break
+            spans.append((first * 8, y_start, last * 8, y_end))
+        return spans
+
+    def store(self, image, x_start=0, y_start=0, x_end=None, y_end=None):
+        """
+        records that a window of image has been written to the current memory area.
+        :returns: the number of bytes written
+        """
+        lw = self.line_width
+        x_end = (lw - 1) * 8 if x_end is None else x_end
+        y_end = self.height - 1 if y_end is None else y_end
+        ram = self.areas[self.index]
+        if ram is None:
+            if (x_start, y_start, x_end, y_end) != (0, 0, (lw - 1) * 8, self.height - 1):
+                return (x_end // 8 - x_start // 8 + 1) * (y_end - y_start + 1)
+            ram = self.areas[self.index] = bytearray(self.frame_size)
+
+        first = x_start // 8
+        last = x_end // 8 + 1
+        for j in range(y_start, y_end + 1):
+            ram[j * lw + first:j * lw + last] = bytes(image[j * lw + first:j * lw + last])
+        return (last - first) * (y_end - y_start + 1)
+
+    def record_upload(self, sent, full_size=None):
+        """
+        :param sent: bytes sent by the upload
+        :param full_size: bytes an upload of the whole frame takes, frame_size unless the driver sends more planes
+        """
+        self.last_sent = sent
+        self.last_skipped = max(0, (full_size or self.frame_size) - sent)
+        self.bytes_sent += self.last_sent
+        self.bytes_skipped += self.last_skipped
+        logger.debug(f"RAM upload: {self.last_sent} bytes sent, {self.last_skipped} skipped")
+
+    def stats(self):
+        return {"last_sent": self.last_sent,
+                "last_skipped": self.last_skipped,
+                "bytes_sent": self.bytes_sent,
+                "bytes_skipped": self.bytes_skipped,
+                "refreshes": self.refreshes}
@@ -0,0 +1,24 @@
+/*****************************************************************************
+* | File        :   sysfs_software_spi_buffer.c
+* | Function    :   bulk transfer entry point for the Jetson Nano software SPI
+* | Info        :
+*   Passing a whole frame in one call saves one ctypes round trip per byte.
+*   Add this file to the build of Waveshare's sysfs_software_spi.so, e.g.
+*
+*   gcc -shared -fPIC -O2 -o sysfs_software_spi.so \
+*       sysfs_software_spi.c sysfs_gpio.c sysfs_software_spi_buffer.c
+*
+*   epdconfig.JetsonNano falls back to one SYSFS_software_spi_transfer call per byte
+*   if the library has been built without it.
+******************************************************************************/
+#include <stdint.h>
+
+uint8_t SYSFS_software_spi_transfer(uint8_t value);
+
+void SYSFS_software_spi_transfer_buffer(const uint8_t *buf, uint32_t len)
+{
+    uint32_t i;
+    for (i = 0; i < len; i++) {
+        SYSFS_software_spi_transfer(buf[i]);
+    }
+}
@@ -0,0 +1,54 @@
+/*****************************************************************************
+* | File        :   sysfs_software_spi_shim.c
+* | Function    :   stand-in for sysfs_software_spi.so on machines without Jetson GPIO
+* | Info        :
+*   Implements the functions epdconfig.JetsonNano calls, but only counts the
+*   transferred bytes and optionally appends them to the file named by the
+*   SPI_SHIM_DUMP environment variable. Build on any Linux box with
+*
+*   gcc -shared -fPIC -O2 -o sysfs_software_spi.so \
+*       sysfs_software_spi_shim.c sysfs_software_spi_buffer.c
+*
+*   and put the .so next to epdconfig.py.
+******************************************************************************/
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+static FILE *dump_file = NULL;
+static uint64_t bytes_transferred = 0;
+
+void SYSFS_software_spi_begin(void)
+{
+    const char *dump_name = getenv("SPI_SHIM_DUMP");
+    if (dump_name && !dump_file) {
+        dump_file = fopen(dump_name, "ab");
+    }
+}
+
+void SYSFS_software_spi_end(void)
+{
+    if (dump_file) {
+        fclose(dump_file);
+        dump_file = NULL;
+    }
+}
+
+uint8_t SYSFS_software_spi_transfer(uint8_t value)
+{
+    bytes_transferred++;
+    if (dump_file) {
+        fputc(value, dump_file);
+    }
+    return 0;
+}
+
+uint64_t SYSFS_software_spi_shim_bytes(void)
+{
+    return bytes_transferred;
+}
+
+void SYSFS_software_spi_shim_reset(void)
+{
+    bytes_transferred = 0;
+}